@@ -0,0 +1,102 @@
+# batch_insights.py
+"""
+Precompute location insights for every Walmart store without the UI, e.g. nightly:
+
+    python batch_insights.py --workers 4 --rate 5
+
+Progress is saved per store, so rerunning after an interruption resumes where it stopped.
+With --radius-only it just refreshes the precomputed suggested radius table instead, e.g. weekly:
+
+    python batch_insights.py --radius-only --industry accommodation
+
+Reads the PredictHQ API key from .streamlit/secrets.toml like the app, or from the
+LOCATION_INSIGHTS_API_KEY environment variable.
+"""
+import argparse
+import datetime
+import logging
+
+from utils.insights import (
+    BATCH_REQUESTS_PER_SECOND,
+    BATCH_WORKERS,
+    DEFAULT_INDUSTRY,
+    INSIGHTS_PATH,
+    STORE_RADIUS_REFRESH_DAYS,
+    get_insights_store,
+    refresh_store_radii,
+    run_batch,
+)
+from utils.predicthq import MAX_EVENTS
+from utils.walmart import STORE_RADIUS_CSV
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", action="append", dest="store_ids", help="only this store ID (repeatable)")
+    parser.add_argument("--limit", type=int, help="process at most this many stores")
+    parser.add_argument("--date-from", type=datetime.date.fromisoformat, help="period start (default: today)")
+    parser.add_argument(
+        "--industry",
+        action="append",
+        dest="industries",
+        help=f"suggested radius industry (default {DEFAULT_INDUSTRY}; repeatable with --radius-only)",
+    )
+    parser.add_argument("--max-events", type=int, default=MAX_EVENTS, help="cap on events fetched per store")
+    parser.add_argument("--geo-snap-precision", type=int, help="geohash precision to snap query origins to")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="stores processed concurrently")
+    parser.add_argument("--rate", type=float, default=BATCH_REQUESTS_PER_SECOND, help="PredictHQ requests per second")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="recompute stores already stored")
+    parser.add_argument("--output", default=INSIGHTS_PATH, help="SQLite file to write")
+    parser.add_argument("--parquet", help="also export the stored summaries to this Parquet file")
+    parser.add_argument("--radius-only", action="store_true", help="only refresh the suggested radius table")
+    parser.add_argument(
+        "--radius-max-age",
+        type=int,
+        default=STORE_RADIUS_REFRESH_DAYS,
+        help="refetch suggested radius rows older than this many days",
+    )
+    parser.add_argument("--radius-output", default=STORE_RADIUS_CSV, help="suggested radius CSV to write")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    industries = args.industries or [DEFAULT_INDUSTRY]
+
+    if args.radius_only:
+        saved, failed = refresh_store_radii(
+            industries=industries,
+            store_ids=args.store_ids,
+            workers=args.workers,
+            requests_per_second=args.rate,
+            limit=args.limit,
+            max_age_days=args.radius_max_age,
+            path=args.radius_output,
+        )
+        logging.info("Saved %d suggested radius rows, %d failed", saved, failed)
+        return 1 if failed else 0
+
+    saved, failed = run_batch(
+        store_ids=args.store_ids,
+        date_from=args.date_from,
+        industry=industries[0],
+        max_events=args.max_events,
+        geo_snap_precision=args.geo_snap_precision,
+        workers=args.workers,
+        requests_per_second=args.rate,
+        limit=args.limit,
+        resume=args.resume,
+        path=args.output,
+    )
+    logging.info("Saved %d stores, %d failed", saved, failed)
+
+    if args.parquet:
+        get_insights_store(args.output).summaries().to_parquet(args.parquet, index=False)
+        logging.info("Exported summaries to %s", args.parquet)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
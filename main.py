@@ -2,29 +2,67 @@
 import streamlit as st
 # import uuid # No longer needed for session token
 
-from groq import Groq
 import datetime
-import pytz
+import functools
+import hashlib
+import logging
+import threading
+import time
 import pandas as pd
+from collections import OrderedDict
 from streamlit_searchbox import st_searchbox # type: ignore
 from utils.pages import set_page_config
 from utils.predicthq import (
     get_api_key,
-    get_predicthq_client,
     fetch_events,
+    fetch_suggested_radius,
+    quantize_query,
+    MAX_EVENTS,
     ATTENDED_CATEGORIES,
     NON_ATTENDED_CATEGORIES,
     UNSCHEDULED_CATEGORIES,
 )
 # Updated imports:
-from utils.walmart import search_walmart_stores, get_walmart_details
-from utils.osm import osm_autocomplete, get_osm_details
+from utils.walmart import (
+    find_walmart_stores_within,
+    find_nearest_walmart_stores,
+    format_walmart_address,
+    get_store_radius,
+    SEARCH_STOPWORDS,
+    STORE_RADIUS_CSV,
+)
+from utils.search import tokenize
+from utils.adapters import (
+    configure_from_secrets,
+    search_walmart_stores,
+    get_walmart_details,
+    local_autocomplete,
+    osm_autocomplete,
+    get_osm_details,
+)
 from utils.map import show_map
-from utils.metrics import show_metrics
-from dateutil.parser import parse as parse_date
+from utils.metrics import fetch_metrics, show_metrics
+from utils.concurrency import run_cancellable, run_concurrently
+from utils.cache import cache_get, cache_set, cache_stats
+from utils.http import connection_stats
+from utils.llm import get_groq_client, product_table
+from utils.insights import INSIGHTS_PATH, INSIGHTS_PERIOD_DAYS, insights_settings_key, load_store_insights
+
+logger = logging.getLogger(__name__)
+
+# Initial map zoom for each "Map detail" option. Below city level the map shows
+# aggregated store and event density instead of individual points.
+MAP_DETAIL_ZOOMS = {
+    "National": 4,
+    "State": 6,
+    "Metro": 9,
+    "City": 11,
+    "Street": 14,
+}
 
 def main():
     set_page_config("Location Insights")
+    configure_from_secrets()
     st.markdown("""
     <style>
     .stDataFrame {
@@ -52,18 +90,33 @@ def main():
     else:
         st.warning("Please set a PredictHQ API Token.", icon="⚠️")
 
+    show_diagnostics()
+
+
+def show_diagnostics():
+    """Process-wide runtime stats, for sizing and checking the shared clients and caches."""
+    with st.sidebar.expander("Diagnostics"):
+        st.caption("HTTP connection reuse")
+        st.dataframe(
+            pd.DataFrame.from_dict(connection_stats(), orient="index"),
+            use_container_width=True,
+            column_config={"reuse_rate": st.column_config.NumberColumn("Reuse rate", format="%.2f")},
+        )
+        st.caption("Caches")
+        st.dataframe(pd.DataFrame.from_dict(cache_stats(), orient="index"), use_container_width=True)
+
 
-def generate_demand_insights(event, walmart_data=None):
-    """Generate demand insights using Groq's ultra-fast LLM"""
-    prompt = f"""
+# Prompt for generate_demand_insights; its hash is part of the cache key, so editing
+# it invalidates previously cached insights
+DEMAND_PROMPT_TEMPLATE = """
 As a Walmart retail demand forecasting expert, analyze this event and provide detailed product-level predictions:
 
 **EVENT ANALYSIS REQUEST**
-- EVENT: {event['Event Title']}
-- TYPE: {event['Category']}
-- EXPECTED ATTENDANCE: {event['PHQ Attendance']:,}
-- DATE: {event['Start Date (local tz)']}
-- VENUE: {event['Venue Name']} ({event['Venue Address']})
+- EVENT: {title}
+- TYPE: {category}
+- EXPECTED ATTENDANCE: {attendance:,}
+- DATE: {start}
+- VENUE: {venue_name} ({venue_address})
 
 **REQUIRED OUTPUT FORMAT**
 1. Trending Products Analysis:
@@ -92,54 +145,265 @@ Ozark Trail 6-Person Tent,Outdoor Gear,15,+120%,33,$89.97,32%
 
 Focus on Walmart's top-selling inventory categories and private label brands (Great Value, Mainstays, etc.) where applicable.
 """
-    
-    try:
-        client = Groq(api_key=st.secrets["groq_api_key"])
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
+DEMAND_PROMPT_VERSION = hashlib.sha256(DEMAND_PROMPT_TEMPLATE.encode()).hexdigest()[:16]
+
+DEMAND_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+DEMAND_TEMPERATURE = 0.5  # Lower for more factual outputs
+DEMAND_MAX_TOKENS = 2000
+# Insights are cached per event, prompt version and model settings
+DEMAND_INSIGHTS_TTL_SECONDS = 7 * 24 * 60 * 60
+# Batch forecasts: default number of events, Groq requests in flight, and overall time limit
+DEMAND_BATCH_SIZE = 10
+DEMAND_BATCH_CONCURRENCY = 4
+DEMAND_BATCH_TIMEOUT_SECONDS = 180
+# Minimum time between streamed updates of the insights text; each one re-sends the whole text
+DEMAND_UPDATE_INTERVAL_SECONDS = 0.1
+
+
+def strip_code_fences(text):
+    return text.replace("```csv", "").replace("```", "")
+
+
+def fetch_demand_insights(event, on_update=None):
+    """
+    The raw LLM response for `event`. The completion is streamed; `on_update` is called
+    with the text so far at most every DEMAND_UPDATE_INTERVAL_SECONDS, and once at the
+    end. Completed responses are cached (in memory and on disk), so showing the same
+    event again costs no tokens.
+    """
+    prompt = DEMAND_PROMPT_TEMPLATE.format(
+        title=event['Event Title'],
+        category=event['Category'],
+        attendance=event['PHQ Attendance'],
+        start=event['Start Date (local tz)'],
+        venue_name=event['Venue Name'],
+        venue_address=event['Venue Address'],
+    )
+    cache_params = {
+        "event_id": event['Event ID'],
+        "prompt_version": DEMAND_PROMPT_VERSION,
+        "model": DEMAND_MODEL,
+        "temperature": DEMAND_TEMPERATURE,
+        "max_tokens": DEMAND_MAX_TOKENS,
+    }
+
+    raw_output = cache_get("demand_insights", cache_params)
+    if raw_output is None:
+        client = get_groq_client()
+        stream = client.chat.completions.create(
+            model=DEMAND_MODEL,
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.5,  # Lower for more factual outputs
-            max_tokens=2000
+            temperature=DEMAND_TEMPERATURE,
+            max_tokens=DEMAND_MAX_TOKENS,
+            stream=True,
         )
-        
-        raw_output = response.choices[0].message.content
-        
-        # Extract CSV data if present
-        csv_data = None
-        if "```csv" in raw_output:
-            csv_data = raw_output.split("```csv")[1].split("```")[0].strip()
-        elif "Product Name,Category" in raw_output:
-            csv_data = raw_output.split("Product Name,Category")[1].split("\n\n")[0]
-            csv_data = "Product Name,Category" + csv_data
+
+        raw_output = ""
+        shown = ""
+        last_update = time.monotonic()
+        for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                raw_output += token
+                if on_update is not None and time.monotonic() - last_update >= DEMAND_UPDATE_INTERVAL_SECONDS:
+                    on_update(strip_code_fences(raw_output))
+                    shown, last_update = raw_output, time.monotonic()
+        if on_update is not None and raw_output != shown:
+            on_update(strip_code_fences(raw_output))
+        if raw_output:
+            cache_set("demand_insights", cache_params, raw_output, DEMAND_INSIGHTS_TTL_SECONDS)
+
+    return raw_output
+
+
+def generate_demand_insights(event, walmart_data=None, on_update=None):
+    """
+    Generate demand insights using Groq's ultra-fast LLM, streamed through `on_update`.
+    Returns the text and the typed product table (None if the response has none).
+    """
+    try:
+        raw_output = fetch_demand_insights(event, on_update=on_update)
+
+        # Parse the product table, now that the whole response is in
+        products = product_table(raw_output)
         
         # Create downloadable CSV
-        if csv_data:
+        if products is not None:
             st.download_button(
                 label="📥 Download Product Recommendations",
-                data=csv_data,
+                data=products.to_csv(index=False),
                 file_name=f"walmart_demand_{event['Event Title'].replace(' ','_')}.csv",
                 mime="text/csv"
             )
         
-        return raw_output.replace("```csv", "").replace("```", "")
+        return strip_code_fences(raw_output), products
     
     except Exception as e:
-        return f"Error generating insights: {str(e)}"
+        return f"Error generating insights: {str(e)}", None
+
+
+def forecast_events(events, max_workers=DEMAND_BATCH_CONCURRENCY):
+    """
+    Forecast demand for each event record in `events`, with at most `max_workers` Groq
+    requests in flight, and merge their product recommendations into one DataFrame with
+    the event ID and title in front. Returns (products, titles of events that failed, had
+    no product table or didn't finish within DEMAND_BATCH_TIMEOUT_SECONDS).
+    """
+    def forecast(event):
+        try:
+            return product_table(fetch_demand_insights(event))
+        except Exception as e:
+            logger.warning("Demand forecast failed for %s: %s", event["Event ID"], e)
+            return None
+
+    results = run_concurrently(
+        {event["Event ID"]: functools.partial(forecast, event) for event in events},
+        timeout=DEMAND_BATCH_TIMEOUT_SECONDS,
+        max_workers=max_workers,
+        # Events still running at the timeout count as failed; the rest are still shown
+        partial=True,
+    )
+
+    frames = []
+    failed = []
+    for event in events:
+        products = results.get(event["Event ID"])
+        if products is None:
+            failed.append(event["Event Title"])
+            continue
+        frames.append(pd.concat([
+            pd.DataFrame({"Event ID": event["Event ID"], "Event Title": event["Event Title"]}, index=products.index),
+            products,
+        ], axis=1))
+
+    return (pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()), failed
+
+
+def show_batch_forecast(events_df):
+    """Forecast the top events by attendance in one go, with one merged CSV download"""
+    if events_df.empty:
+        return
+
+    with st.expander("📦 Batch Demand Forecast"):
+        top_n = st.number_input(
+            "Events to forecast (by attendance)",
+            min_value=1,
+            max_value=len(events_df),
+            value=min(DEMAND_BATCH_SIZE, len(events_df)),
+        )
+        if st.button("Forecast top events"):
+            top_events = events_df.nlargest(int(top_n), "PHQ Attendance").to_dict("records")
+            with st.spinner(f"Forecasting demand for {len(top_events)} events..."):
+                products, failed = forecast_events(top_events)
+            # Keep the results for reruns triggered by other widgets (e.g. the download button)
+            st.session_state["batch_forecast"] = {
+                "event_ids": [event["Event ID"] for event in top_events],
+                "products": products,
+                "failed": failed,
+            }
+
+        batch = st.session_state.get("batch_forecast")
+        if batch is None or not set(batch["event_ids"]) <= set(events_df["Event ID"]):
+            return
+
+        if batch["failed"]:
+            st.warning(f"No forecast for: {', '.join(batch['failed'])}")
+        if not batch["products"].empty:
+            st.dataframe(batch["products"], use_container_width=True, hide_index=True)
+            st.download_button(
+                label="📥 Download All Product Recommendations",
+                data=batch["products"].to_csv(index=False),
+                file_name="walmart_demand_top_events.csv",
+                mime="text/csv",
+            )
 
     
-# Updated function
+# Address lookups wait this long for the user to stop typing before calling Nominatim
+ADDRESS_LOOKUP_DEBOUNCE_SECONDS = 0.3
+# Suggestions shown per lookup
+WALMART_LOOKUP_LIMIT = 10
+OSM_LOOKUP_LIMIT = 5
+# Recent lookups remembered per session, so extending a query can filter their results
+ADDRESS_LOOKUP_MEMO_SIZE = 32
+
+
+def _lookup_memo():
+    if "address_lookup_memo" not in st.session_state:
+        st.session_state["address_lookup_memo"] = OrderedDict()
+    return st.session_state["address_lookup_memo"]
+
+
+def _remember_lookup(memo, text, results, complete):
+    memo[text] = (results, complete)
+    memo.move_to_end(text)
+    while len(memo) > ADDRESS_LOOKUP_MEMO_SIZE:
+        memo.popitem(last=False)
+    return results
+
+
+def _narrow_previous_lookup(memo, text):
+    """
+    If a complete result list for a prefix of `text` is memoized (from the same kind of search),
+    return its suggestions whose text still contains every query token (as a word prefix), or
+    None to run a new search.
+    """
+    is_walmart = "walmart" in text.lower()
+    prefixes = [
+        query for query, (_, complete) in memo.items()
+        if complete and text.startswith(query) and ("walmart" in query.lower()) == is_walmart
+    ]
+    if not prefixes:
+        return None
+
+    results, _ = memo[max(prefixes, key=len)]
+    tokens = [token for token in tokenize(text) if token not in SEARCH_STOPWORDS]
+    narrowed = [
+        (description, place_id)
+        for description, place_id in results
+        if all(any(word.startswith(token) for word in tokenize(description)) for token in tokens)
+    ]
+    return narrowed or None
+
+
 def lookup_address(text):
     if len(text) > 3:
+        memo = _lookup_memo()
+        if text in memo:
+            memo.move_to_end(text)
+            return memo[text][0]
+
+        narrowed = _narrow_previous_lookup(memo, text)
+        if narrowed is not None:
+            return _remember_lookup(memo, text, narrowed, complete=True)
+
         # Check if it's a Walmart store search
         if "walmart" in text.lower():
             search_term = text.lower().replace("walmart", "").strip()
             if search_term:
-                results = search_walmart_stores(search_term)
+                results = search_walmart_stores(search_term, limit=WALMART_LOOKUP_LIMIT)
+                if results is None:
+                    # The error has been shown; don't remember it, so retyping retries
+                    return []
                 # Format for st_searchbox
-                return [(r["description"], r["place_id"]) for r in results]
-        
-        # If not Walmart, do normal OSM search
-        return osm_autocomplete(text)
+                results = [(r["description"], r["place_id"]) for r in results]
+                # Fewer results than the limit means the list holds every match
+                return _remember_lookup(memo, text, results, complete=len(results) < WALMART_LOOKUP_LIMIT)
+
+        results = local_autocomplete(text, limit=OSM_LOOKUP_LIMIT)
+        if results:
+            # The gazetteer is a prefix search too, so a short list holds every match
+            return _remember_lookup(memo, text, results, complete=len(results) < OSM_LOOKUP_LIMIT)
+
+        # If nothing matched locally, do a normal OSM search. Debounced, and abandoned
+        # if another keystroke comes in first, so only the latest query reaches Nominatim.
+        results = run_cancellable(
+            lambda: osm_autocomplete(text, limit=OSM_LOOKUP_LIMIT),
+            delay=ADDRESS_LOOKUP_DEBOUNCE_SECONDS,
+        )
+        if results is None:
+            return []
+        # Nominatim isn't a prefix search, so its results can't be narrowed for longer queries
+        return _remember_lookup(memo, text, results, complete=False)
     else:
         return []
 
@@ -198,60 +462,162 @@ def show_location_insights(place_id):
 
     tz = "UTC"
     date_from = datetime.datetime.now().date()
-    date_to = date_from + datetime.timedelta(days=85)
+    date_to = date_from + datetime.timedelta(days=INSIGHTS_PERIOD_DAYS)
     categories = ATTENDED_CATEGORIES
     suggested_radius_industry = st.secrets["suggested_radius_industry"] if "suggested_radius_industry" in st.secrets else "accommodation"
 
-    # Fetch data (can be cached)
-    radius, radius_unit = fetch_suggested_radius(lat, lon, radius_unit="mi", industry=suggested_radius_industry)
-    events = fetch_events(
-        lat,
-        lon,
-        radius=radius,
-        date_from=date_from,
-        date_to=date_to,
-        tz=tz,
-        categories=categories,
-        radius_unit=radius_unit,
+    max_events = st.secrets["max_events"] if "max_events" in st.secrets else MAX_EVENTS
+    geo_snap_precision = st.secrets["geo_snap_precision"] if "geo_snap_precision" in st.secrets else None
+
+    # API queries use the origin snapped to a geohash cell (if configured) so nearby
+    # lookups share cached responses; the map stays centred on the exact location.
+    query_lat, query_lon, date_from, date_to = quantize_query(
+        lat, lon, date_from, date_to, precision=geo_snap_precision
     )
 
-    # Display UI (not cached)
+    # Stores precomputed by batch_insights.py are served from its output, with no API calls
+    stored_insights = None
+    if is_walmart and walmart_data:
+        stored_insights = load_store_insights(
+            walmart_data["store_id"],
+            date_from,
+            date_to,
+            insights_settings_key(suggested_radius_industry, max_events, geo_snap_precision, tz),
+            path=st.secrets["insights_path"] if "insights_path" in st.secrets else INSIGHTS_PATH,
+        )
+
+    # Fetch data (can be cached). The events and metrics requests all need the
+    # suggested radius, so fetch that first and then run the rest concurrently. Walmart
+    # stores normally have it precomputed (batch_insights.py --radius-only), with no round trip.
+    if stored_insights is not None:
+        radius, radius_unit = stored_insights["radius"], stored_insights["radius_unit"]
+    else:
+        store_radius = None
+        if is_walmart and walmart_data:
+            store_radius = get_store_radius(
+                walmart_data["store_id"],
+                suggested_radius_industry,
+                path=st.secrets["store_radius_path"] if "store_radius_path" in st.secrets else STORE_RADIUS_CSV,
+            )
+        radius, radius_unit = store_radius or fetch_suggested_radius(
+            query_lat, query_lon, radius_unit="mi", industry=suggested_radius_industry
+        )
+    radius_meters = calc_meters(radius, radius_unit)
+
+    # Display UI (not cached). Placeholders keep the page order while events stream in.
     st.header(f"Over the next 90 days in {name}, you could be missing out on:")
-    
-    show_metrics(
-        lat=lat,
-        lon=lon,
-        radius=radius,
-        radius_unit=radius_unit,
-        date_from=date_from,
-        date_to=date_to,
-        suggested_radius={"radius": radius, "radius_unit": radius_unit},
-        tz=tz
-    )
+    metrics_container = st.container()
 
-    show_map(
-        lat=lat,
-        lon=lon,
-        radius_meters=calc_meters(radius, radius_unit),
-        events=events,
-    )
+    map_col1, map_col2 = st.columns([3, 1])
+    with map_col1:
+        map_detail = st.select_slider("Map detail", options=list(MAP_DETAIL_ZOOMS), value="Street")
+    with map_col2:
+        show_all_stores = st.toggle("Show all Walmart stores on the map", value=False)
+    map_placeholder = st.empty()
+
+    if not is_walmart:
+        show_nearby_walmart_stores(lat, lon, radius, radius_unit)
 
     if is_walmart and walmart_data:
         with st.expander("Walmart Store Details"):
             st.write(f"**Address:** {address}")
             st.write(f"**Phone:** {walmart_data.get('phone_number_1', 'N/A')}")
-            st.write(f"**Hours:** {walmart_data.get('open_hours', 'N/A')}")
+            st.write(f"**Hours:** {walmart_data.get('open_hours') or 'N/A'}")
             st.write(f"**[View on Walmart.com]({walmart_data.get('url', '')})**")
 
-    show_events_list(events)  # This contains widgets
+    events_placeholder = st.empty()
+
+    def render_map(events):
+        with map_placeholder:
+            show_map(
+                lat=lat,
+                lon=lon,
+                radius_meters=radius_meters,
+                events=events,
+                show_all_stores=show_all_stores,
+                zoom=MAP_DETAIL_ZOOMS[map_detail],
+            )
 
+    # The events loaded so far, so a timeout can still show them, and whether this run has
+    # stopped waiting for the fetch (its later pages then stop paging instead of redrawing)
+    loaded = {"events": None}
+    abandoned = threading.Event()
+
+    def show_partial_events(events):
+        if abandoned.is_set():
+            raise TimeoutError("Events fetch abandoned after a timeout")
+        loaded["events"] = events
+        render_map(events)
+        with events_placeholder.container():
+            st.caption(f"Loading events... {len(events['results']):,} of {min(events['count'], max_events):,}")
+            st.dataframe(events_to_dataframe(events), use_container_width=True, hide_index=True)
+
+    if stored_insights is not None:
+        fetched = {"events": stored_insights["events"], "metrics": stored_insights["metrics"]}
+    else:
+        fetched = run_concurrently({
+            "events": lambda: fetch_events(
+                query_lat,
+                query_lon,
+                radius=radius,
+                date_from=date_from,
+                date_to=date_to,
+                tz=tz,
+                categories=categories,
+                radius_unit=radius_unit,
+                max_events=max_events,
+                on_page=show_partial_events,
+            ),
+            "metrics": lambda: fetch_metrics(
+                query_lat, query_lon, radius, radius_unit, date_from, date_to, tz=tz
+            ),
+        }, partial=True)
+        if len(fetched) < 2:
+            abandoned.set()
+
+    events = fetched.get("events") or loaded["events"] or {"count": 0, "results": []}
+
+    with metrics_container:
+        if "metrics" not in fetched:
+            st.error("Timed out loading the attendance metrics.")
+        else:
+            show_metrics(
+                lat=query_lat,
+                lon=query_lon,
+                radius=radius,
+                radius_unit=radius_unit,
+                date_from=date_from,
+                date_to=date_to,
+                suggested_radius={"radius": radius, "radius_unit": radius_unit},
+                tz=tz,
+                metrics=fetched["metrics"],
+            )
 
-@st.cache_data
-def fetch_suggested_radius(lat, lon, radius_unit="mi", industry="parking"):
-    phq = get_predicthq_client()
-    suggested_radius = phq.radius.search(location__origin=f"{lat},{lon}", radius_unit=radius_unit, industry=industry)
+    render_map(events)
+    with events_placeholder.container():
+        if "events" not in fetched:
+            st.error(f"Timed out loading events; showing the {len(events['results']):,} loaded so far.")
+        if events["count"] > len(events["results"]):
+            st.caption(f"Showing the top {len(events['results']):,} of {events['count']:,} events by attendance.")
+        show_events_list(events)  # This contains widgets
+
+
+def show_nearby_walmart_stores(lat, lon, radius, radius_unit, limit=10):
+    """List the Walmart stores inside the suggested radius, or the nearest ones if there are none."""
+    stores = find_walmart_stores_within(lat, lon, calc_meters(radius, radius_unit)).head(limit)
+    title = f"Walmart stores within {radius}{radius_unit}"
+    if stores.empty:
+        stores = find_nearest_walmart_stores(lat, lon, k=5)
+        title = "Nearest Walmart stores"
+
+    nearby = pd.DataFrame({
+        "Store": stores["name"],
+        "Address": stores.apply(format_walmart_address, axis=1),
+        f"Distance ({radius_unit})": (stores["distance_meters"] / calc_meters(1, radius_unit)).round(1),
+    })
 
-    return suggested_radius.radius, suggested_radius.radius_unit
+    with st.expander(f"🏬 {title} ({len(nearby)})"):
+        st.dataframe(nearby, use_container_width=True, hide_index=True)
 
 
 def calc_meters(value, unit):
@@ -265,24 +631,17 @@ def calc_meters(value, unit):
         return value
 
 
-def visualize_demand(event):
-    """Create visualizations for demand predictions"""
-    # Example visualization - you can customize this based on your LLM response
-    categories = ["Snacks", "Beverages", "Sunscreen", "Grilling Supplies", "Party Decorations"]
-    demand_increase = [45, 60, 30, 55, 40]  # These would come from your LLM analysis
-    
-    # Create a bar chart
-    chart_data = pd.DataFrame({
-        "Product Category": categories,
-        "Estimated Demand Increase (%)": demand_increase
-    })
-    
-    st.bar_chart(
-        chart_data,
-        x="Product Category",
-        y="Estimated Demand Increase (%)",
-        color="#FFA500"  # Walmart blue would be #0071CE
-    )
+def visualize_demand(event, products=None):
+    """Chart the recommended stock increase per product from the parsed forecast"""
+    if products is None or products["Recommended Increase (%)"].isna().all():
+        st.info("The forecast has no product table to chart.")
+    else:
+        st.bar_chart(
+            products.dropna(subset=["Recommended Increase (%)"]),
+            x="Product Name",
+            y="Recommended Increase (%)",
+            color="#FFA500"  # Walmart blue would be #0071CE
+        )
     
     # Profitability estimate
     st.metric(
@@ -291,42 +650,97 @@ def visualize_demand(event):
         delta=f"{event['PHQ Attendance']} attendees"
     )
 
+# Columns of the events table, in order
+EVENT_TABLE_COLUMNS = [
+    "Event ID",
+    "Event Title",
+    "PHQ Attendance",
+    "Category",
+    "Start Date (local tz)",
+    "End Date (local tz)",
+    "Predicted End Date (local tz)",
+    "Venue Name",
+    "Venue Address",
+    "Placekey",
+    "Predicted Event Spend",
+    "Predicted Event Spend (Hospitality)",
+]
+
+
+def _local_times(timestamps, timezones):
+    """Format UTC timestamps in each row's timezone, converting one timezone group at a time."""
+    formatted = pd.Series("", index=timestamps.index, dtype=object)
+    for tz, rows in timezones.groupby(timezones).groups.items():
+        local = timestamps[rows].dt.tz_convert(tz).dt.strftime("%d-%b-%Y %H:%M")
+        formatted[rows] = local.where(local.notna(), "")
+
+    return formatted
+
+
+def _format_spend(values):
+    spend = pd.to_numeric(values, errors="coerce")
+    return spend.map("${:,.0f}".format).where(spend.notna(), "")
+
+
+def events_to_dataframe(events):
+    """One row per event with the columns shown in the events table."""
+    results = pd.DataFrame.from_records(events["results"])
+    if results.empty:
+        return pd.DataFrame(columns=EVENT_TABLE_COLUMNS)
+
+    def column(name):
+        return results[name] if name in results else pd.Series(None, index=results.index, dtype=object)
+
+    # First venue entity of each event
+    entities = column("entities").explode().dropna()
+    entities = pd.DataFrame(entities.tolist(), index=entities.index)
+    if "type" in entities:
+        venues = entities[entities["type"] == "venue"]
+        venues = venues[~venues.index.duplicated()].reindex(results.index)
+    else:
+        venues = pd.DataFrame(index=results.index)
+
+    def venue_field(name):
+        return venues[name].fillna("") if name in venues else ""
+
+    timezones = column("timezone").fillna("UTC")
+
+    def local_dates(name):
+        return _local_times(pd.to_datetime(column(name), utc=True, format="ISO8601"), timezones)
+
+    return pd.DataFrame({
+        "Event ID": results["id"],
+        "Event Title": results["title"],
+        "PHQ Attendance": pd.to_numeric(column("phq_attendance")).fillna(0).astype("int64"),
+        "Category": results["category"],
+        "Start Date (local tz)": local_dates("start"),
+        "End Date (local tz)": local_dates("end"),
+        "Predicted End Date (local tz)": local_dates("predicted_end"),
+        "Venue Name": venue_field("name"),
+        "Venue Address": venue_field("formatted_address"),
+        "Placekey": column("geo").str.get("placekey").fillna(""),
+        "Predicted Event Spend": _format_spend(column("predicted_event_spend")),
+        "Predicted Event Spend (Hospitality)": _format_spend(
+            column("predicted_event_spend_industries").str.get("hospitality")
+        ),
+    }, columns=EVENT_TABLE_COLUMNS)
+
+
+def get_events_table(events):
+    """
+    events_to_dataframe for the current events payload, kept in session state so reruns
+    (selecting an event, clicking a widget) reuse it. Cached payloads are the same object
+    on every rerun, so identity is enough to tell them apart.
+    """
+    memo = st.session_state.get("events_table")
+    if memo is None or memo[0] is not events:
+        memo = st.session_state["events_table"] = (events, events_to_dataframe(events))
+    return memo[1]
+
+
 def show_events_list(events):
     """Display events in a clickable dataframe with demand insights"""
-    results = []
-    
-    for event in events["results"]:
-        venue = next(filter(lambda entity: entity["type"] == "venue", event["entities"]), None)
-        
-        row = {
-                  "Event Title": event["title"],
-            "PHQ Attendance": event["phq_attendance"] if event["phq_attendance"] else 0,
-            "Category": event["category"],
-            "Start Date (local tz)": parse_date(event["start"])
-            .astimezone(pytz.timezone(event["timezone"]))
-            .strftime("%d-%b-%Y %H:%M"),
-            "End Date (local tz)": parse_date(event["end"])
-            .astimezone(pytz.timezone(event["timezone"]))
-            .strftime("%d-%b-%Y %H:%M"),
-            "Predicted End Date (local tz)": parse_date(event["predicted_end"])
-            .astimezone(pytz.timezone(event["timezone"]))
-            .strftime("%d-%b-%Y %H:%M")
-            if "predicted_end" in event and event["predicted_end"] is not None
-            else "",
-            "Venue Name": venue["name"] if venue else "",
-            "Venue Address": venue["formatted_address"] if venue else "",
-            "Placekey": event["geo"]["placekey"] if "geo" in event and "placekey" in event["geo"] else "",
-            "Predicted Event Spend": f"${event['predicted_event_spend']:,.0f}"
-            if "predicted_event_spend" in event and event["predicted_event_spend"] is not None
-            else "",
-            "Predicted Event Spend (Hospitality)": f"${event['predicted_event_spend_industries']['hospitality']:,.0f}"
-            if "predicted_event_spend_industries" in event
-            and event["predicted_event_spend_industries"]["hospitality"] is not None
-            else "",
-        }
-        results.append(row)
-
-    events_df = pd.DataFrame(results)
+    events_df = get_events_table(events)
     
     # Display the dataframe with clickable rows
     st.dataframe(
@@ -351,6 +765,8 @@ def show_events_list(events):
         }
     )
     
+    show_batch_forecast(events_df)
+
     # Add selectbox to choose an event for detailed analysis
     selected_event = st.selectbox(
         "Select an event for demand analysis:",
@@ -361,28 +777,34 @@ def show_events_list(events):
     )
     
     if selected_event:
-        with st.spinner("Generating demand insights..."):
-            insights = generate_demand_insights(selected_event)
         with st.expander("🚀 Real-time Demand Forecast", expanded=True):
-            st.markdown(
-                f"""
-                <div style="
-                    background: #000000;
-                    padding: 15px;
-                    border-radius: 10px;
-                    border-left: 4px solid #2d8b49;
-                ">
-                {insights}
-                </div>
-                """,
-                unsafe_allow_html=True
-            )    
+            insights_placeholder = st.empty()
+            insights_placeholder.caption("Generating demand insights...")
+
+            # Render tokens as they stream in, then the final text
+            def render_insights(insights):
+                insights_placeholder.markdown(
+                    f"""
+                    <div style="
+                        background: #000000;
+                        padding: 15px;
+                        border-radius: 10px;
+                        border-left: 4px solid #2d8b49;
+                    ">
+                    {insights}
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+
+            insights, products = generate_demand_insights(selected_event, on_update=render_insights)
+            render_insights(insights)
         
        
         
         # Add visualization section
         st.markdown("### 📊 Demand Visualization")
-        visualize_demand(selected_event)
+        visualize_demand(selected_event, products)
 
 
 if __name__ == "__main__":
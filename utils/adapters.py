@@ -0,0 +1,49 @@
+# utils/adapters.py
+"""
+Streamlit adapters over the data-access modules (utils.predicthq, utils.walmart, utils.osm),
+which don't use Streamlit themselves: settings come from st.secrets, and lookup errors are
+shown with st.error instead of failing the page.
+"""
+import functools
+
+import streamlit as st
+
+from utils import osm, walmart
+from utils.config import configure
+
+
+def configure_from_secrets():
+    """Pass st.secrets to the data-access layer as its settings."""
+    try:
+        configure(**st.secrets)
+    except FileNotFoundError:
+        # No secrets file; the data-access layer falls back to the environment
+        pass
+
+
+def show_errors(message, default=None):
+    """
+    Wrap a data-access function so that an exception is shown as "`message`: <error>" and
+    `default()` (or `default`, if it isn't callable) is returned in its place.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                st.error(f"{message}: {e}")
+                return default() if callable(default) else default
+
+        return wrapper
+
+    return decorator
+
+
+# The searches return None (not an empty list) on failure, so callers can tell "no matches",
+# which is worth remembering, from an error, which isn't
+search_walmart_stores = show_errors("Error loading Walmart data")(walmart.search_walmart_stores)
+get_walmart_details = show_errors("Error getting Walmart store details")(walmart.get_walmart_details)
+local_autocomplete = show_errors("Error loading gazetteer")(osm.local_autocomplete)
+osm_autocomplete = show_errors("Geocoding error")(osm.osm_autocomplete)
+get_osm_details = show_errors("Geocoding error")(osm.get_osm_details)
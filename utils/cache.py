@@ -0,0 +1,345 @@
+# utils/cache.py
+import datetime
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from utils.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# SQLite file shared by every process on the host; WAL mode lets them read and write concurrently
+CACHE_PATH = os.path.join(".cache", "api_cache.sqlite3")
+# Least recently used entries are evicted once the stored (compressed) payloads exceed this
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Default limits for each namespace's in-memory cache, which sits in front of the disk cache
+MEMORY_CACHE_MAX_ENTRIES = 256
+MEMORY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Limit on all memory caches together, however many namespaces there are; the
+# `memory_cache_max_bytes` setting overrides it (size containers for this plus the app itself)
+MEMORY_CACHE_TOTAL_MAX_BYTES = 128 * 1024 * 1024
+
+
+def _normalize(value):
+    """Turn request parameters into a canonical, JSON-serialisable form for cache keys."""
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_normalize(v) for v in value]
+        # Lists of names (categories, features) are sets as far as the APIs are concerned
+        return sorted(items) if all(isinstance(v, str) for v in items) else items
+    return value
+
+
+def make_key(namespace, params):
+    payload = json.dumps(_normalize(params), sort_keys=True, default=str)
+    return f"{namespace}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+class DiskCache:
+    """
+    A size-bounded, TTL'd key-value cache in SQLite. Values are pickled and zlib-compressed.
+    Safe to share between threads (one connection each) and processes (WAL journal).
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def _reset_after_fork(self):
+        # SQLite connections must not be used (or closed) in a forked child: keep the
+        # inherited ones referenced but unused, and open new ones on demand
+        self._inherited = self._local
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return the cached value for `key`, or None if it's missing or expired."""
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key):
+        """Return (value, expiry timestamp) for `key`, or None if it's missing or expired."""
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires FROM entries WHERE key = ? AND expires > ?", (key, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+
+        return pickle.loads(zlib.decompress(row[0])), row[1]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, blob, len(blob), now + ttl, now),
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Drop least recently used entries until we're back under the limit
+        excess = total - self.max_bytes
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM entries")
+
+    def stats(self):
+        entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+
+class MemoryCache:
+    """
+    A thread-safe in-process LRU cache bounded by entry count and by total size (measured
+    as pickled bytes), with a TTL per entry. Counts hits, misses and evictions.
+    """
+
+    def __init__(self, max_entries=MEMORY_CACHE_MAX_ENTRIES, max_bytes=MEMORY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires):
+        """Store `value` until the `expires` timestamp. Values larger than max_bytes aren't stored."""
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def evict_oldest(self):
+        """Evict the least recently used entry; False if the cache is empty."""
+        with self._lock:
+            if not self._entries:
+                return False
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+@functools.cache
+def get_disk_cache(path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+    """The process-wide DiskCache for `path`."""
+    return DiskCache(path, max_bytes)
+
+
+# One MemoryCache per namespace (endpoint or helper), created on first use
+_memory_caches = {}
+_memory_caches_lock = threading.Lock()
+
+
+def _reset_locks_after_fork():
+    # A lock held by another thread at fork time would never be released in the child
+    global _memory_caches_lock
+    _memory_caches_lock = threading.Lock()
+    for cache in _memory_caches.values():
+        cache._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+def get_memory_cache(namespace, max_entries=MEMORY_CACHE_MAX_ENTRIES, max_bytes=MEMORY_CACHE_MAX_BYTES):
+    with _memory_caches_lock:
+        cache = _memory_caches.get(namespace)
+        if cache is None:
+            cache = _memory_caches[namespace] = MemoryCache(max_entries, max_bytes)
+        return cache
+
+
+def get_memory_budget():
+    """The byte limit on all memory caches together."""
+    return int(get_setting("memory_cache_max_bytes", MEMORY_CACHE_TOTAL_MAX_BYTES))
+
+
+def _enforce_memory_budget():
+    """Evict the oldest entries of the largest memory caches until they fit the overall budget."""
+    budget = get_memory_budget()
+    with _memory_caches_lock:
+        caches = list(_memory_caches.values())
+    while sum(cache._bytes for cache in caches) > budget:
+        if not max(caches, key=lambda cache: cache._bytes).evict_oldest():
+            break
+
+
+def cache_stats():
+    """Size, limits and hit/miss/eviction counts of every memory cache, plus the disk cache."""
+    stats = {namespace: cache.stats() for namespace, cache in list(_memory_caches.items())}
+    stats["memory (all)"] = {
+        "entries": sum(namespace_stats["entries"] for namespace_stats in stats.values()),
+        "bytes": sum(namespace_stats["bytes"] for namespace_stats in stats.values()),
+        "max_bytes": get_memory_budget(),
+    }
+    try:
+        stats["disk"] = get_disk_cache().stats()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Cache stats failed: %s", e)
+
+    return stats
+
+
+def cache_get(namespace, params, persist=True):
+    """
+    Look `params` up in the namespace's memory cache, then (if `persist`) on disk. A broken or
+    locked cache file is treated as a miss rather than failing the request.
+    """
+    key = make_key(namespace, params)
+    memory = get_memory_cache(namespace)
+    value = memory.get(key)
+    if value is not None or not persist:
+        return value
+
+    try:
+        entry = get_disk_cache().get_entry(key)
+    except (sqlite3.Error, pickle.UnpicklingError, zlib.error, OSError) as e:
+        logger.warning("Cache read failed for %s: %s", key, e)
+        return None
+    if entry is None:
+        return None
+
+    value, expires = entry
+    memory.set(key, value, expires)
+    _enforce_memory_budget()
+    return value
+
+
+def cache_set(namespace, params, value, ttl, persist=True):
+    key = make_key(namespace, params)
+    get_memory_cache(namespace).set(key, value, time.time() + ttl)
+    _enforce_memory_budget()
+    if not persist:
+        return
+
+    try:
+        get_disk_cache().set(key, value, ttl)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Cache write failed for %s: %s", key, e)
+
+
+def cached(namespace, ttl, persist=True):
+    """
+    Cache a function's results for `ttl` seconds, keyed on its normalized arguments: in a
+    bounded memory cache, backed by the disk cache if `persist`. None results aren't cached.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+
+            value = cache_get(namespace, params, persist=persist)
+            if value is None:
+                value = func(*args, **kwargs)
+                if value is not None:
+                    cache_set(namespace, params, value, ttl, persist=persist)
+
+            return value
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,73 @@
+# utils/concurrency.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Upper bound on how long a page waits for a batch of concurrent calls. Individual
+# HTTP requests have their own, shorter timeouts (see utils.predicthq).
+FAN_OUT_TIMEOUT_SECONDS = 60
+# How often run_cancellable gives Streamlit a chance to stop a superseded script run
+CANCEL_POLL_SECONDS = 0.1
+
+
+def _attach_ctx_initializer():
+    ctx = get_script_run_ctx()
+
+    def attach_ctx():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+    return attach_ctx
+
+
+def run_concurrently(calls, timeout=FAN_OUT_TIMEOUT_SECONDS, max_workers=None, partial=False):
+    """
+    Run the zero-argument callables in `calls` ({name: callable}) on a thread pool and return
+    {name: result}. At most `max_workers` run at once (default: all of them). Worker threads
+    inherit the current Streamlit script context so cached functions, secrets and st.* calls
+    behave as they do on the main thread. The first exception raised by a call is re-raised
+    here; a TimeoutError is raised if the batch doesn't finish within `timeout` seconds,
+    unless `partial`, in which case the calls that didn't finish are left out of the result.
+    """
+    workers = len(calls) if max_workers is None else min(max_workers, len(calls))
+    pool = ThreadPoolExecutor(max_workers=max(workers, 1), initializer=_attach_ctx_initializer())
+    try:
+        futures = {name: pool.submit(call) for name, call in calls.items()}
+        _, not_done = wait(futures.values(), timeout=timeout)
+        if not_done and not partial:
+            pending = ", ".join(name for name, future in futures.items() if future in not_done)
+            raise TimeoutError(f"Timed out after {timeout}s waiting for: {pending}")
+
+        return {name: future.result() for name, future in futures.items() if future not in not_done}
+    finally:
+        # Don't block on stragglers after a timeout; their HTTP timeouts will end them
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_cancellable(call, delay=0, poll_interval=CANCEL_POLL_SECONDS):
+    """
+    Wait `delay` seconds, then run the zero-argument `call` on a worker thread and return its
+    result. Both waits happen in short steps, each of which updates an empty placeholder:
+    that's a point where Streamlit stops the script run if a newer rerun has been requested
+    (e.g. by another keystroke in a searchbox). A superseded call that's still in its delay
+    never starts; one already running is abandoned and its result discarded.
+    """
+    placeholder = st.empty()
+    deadline = time.monotonic() + delay
+    while time.monotonic() < deadline:
+        time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+        placeholder.empty()
+
+    pool = ThreadPoolExecutor(max_workers=1, initializer=_attach_ctx_initializer())
+    try:
+        future = pool.submit(call)
+        while True:
+            done, _ = wait([future], timeout=poll_interval)
+            if done:
+                return future.result()
+            placeholder.empty()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,51 @@
+# utils/config.py
+import functools
+import os
+import tomllib
+
+# Where settings are read from when they haven't been passed to configure(), in order of
+# precedence: the project's secrets file, then the global one (the same files st.secrets reads)
+SECRETS_PATHS = [
+    os.path.join(os.getcwd(), ".streamlit", "secrets.toml"),
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+]
+# Environment variables override both files, e.g. LOCATION_INSIGHTS_API_KEY for `api_key`
+ENV_PREFIX = "LOCATION_INSIGHTS_"
+
+# Settings passed to configure() in this process; they take precedence over everything else
+_settings = {}
+
+
+def configure(**settings):
+    """
+    Set settings (api_key, groq_api_key, gazetteer_path, ...) for this process explicitly,
+    e.g. from st.secrets in the app or from command-line arguments in a batch job.
+    """
+    _settings.update(settings)
+
+
+@functools.cache
+def _load_secrets(path, mtime):
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def get_setting(name, default=None):
+    """
+    A setting from configure(), the environment or the secrets file, or `default`. Doesn't
+    need Streamlit, so worker processes and scripts see the same settings as the app.
+    """
+    if name in _settings:
+        return _settings[name]
+
+    value = os.environ.get(ENV_PREFIX + name.upper())
+    if value is not None:
+        return value
+
+    for path in SECRETS_PATHS:
+        if os.path.exists(path):
+            secrets = _load_secrets(path, os.path.getmtime(path))
+            if name in secrets:
+                return secrets[name]
+
+    return default
@@ -0,0 +1,194 @@
+# utils/gazetteer.py
+import functools
+import logging
+import os
+
+import pandas as pd
+
+from utils.config import get_setting
+from utils.search import build_search_index, rank, tokenize
+from utils.walmart import WALMART_CSV, get_walmart_stores
+
+logger = logging.getLogger(__name__)
+
+# Columns of an importable place extract (CSV). name, latitude and longitude are required;
+# address is shown in suggestions, aliases are searchable but not shown, and importance
+# orders equally good matches (e.g. population).
+GAZETTEER_COLUMNS = ["name", "address", "aliases", "latitude", "longitude", "importance"]
+
+# Relative weight of a query token matching each field
+GAZETTEER_FIELD_WEIGHTS = {"name": 3, "address": 1, "aliases": 1}
+
+# Words in typical US address queries that no place name contains ("Conway, AR, USA")
+GAZETTEER_STOPWORDS = {"usa", "us"}
+
+US_STATE_NAMES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+    "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+    "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+    "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+    "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+    "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+    "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+    "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming",
+    "PR": "Puerto Rico",
+}
+
+
+def _builtin_places(stores):
+    """
+    Cities and zip codes with a Walmart store, at the centroid of their stores. Always
+    available offline; importance is the number of stores, so bigger places rank first.
+    """
+    stores = stores.assign(
+        city=stores["city"].astype(str),
+        state=stores["state"].astype(str),
+        latitude=stores["latitude"].astype("float64"),
+        longitude=stores["longitude"].astype("float64"),
+    )
+    centroid = {"latitude": ("latitude", "mean"), "longitude": ("longitude", "mean"), "importance": ("name", "size")}
+
+    cities = stores.groupby(["city", "state"]).agg(**centroid).reset_index()
+    cities = cities.assign(
+        name=cities["city"],
+        address=cities["city"] + ", " + cities["state"],
+        aliases=cities["state"].map(US_STATE_NAMES).fillna(""),
+    )
+
+    zip_codes = stores.groupby(["zip_code", "city", "state"]).agg(**centroid).reset_index()
+    zip_codes = zip_codes.assign(
+        name=zip_codes["zip_code"].astype(str),
+        address=zip_codes["city"] + ", " + zip_codes["state"] + " " + zip_codes["zip_code"].astype(str),
+        aliases=zip_codes["state"].map(US_STATE_NAMES).fillna(""),
+    )
+
+    return pd.concat([cities[GAZETTEER_COLUMNS], zip_codes[GAZETTEER_COLUMNS]], ignore_index=True)
+
+
+def _load_extract(path):
+    extract = pd.read_csv(path, dtype={"name": "string", "address": "string", "aliases": "string"})
+    for column, default in (("address", extract["name"]), ("aliases", ""), ("importance", 0)):
+        if column not in extract:
+            extract[column] = default
+    extract["address"] = extract["address"].fillna(extract["name"])
+
+    return extract[GAZETTEER_COLUMNS].dropna(subset=["name", "latitude", "longitude"])
+
+
+@functools.lru_cache(maxsize=1)
+def _build_gazetteer(extract_path, extract_mtime, stores_path, stores_mtime):
+    """The place table plus its autocomplete index; equal scores sort by importance, then name."""
+    places = _builtin_places(get_walmart_stores(stores_path))
+    if extract_path:
+        places = pd.concat([_load_extract(extract_path), places], ignore_index=True)
+    places = places.assign(
+        address=places["address"].fillna("").astype(str),
+        aliases=places["aliases"].fillna("").astype(str),
+        importance=pd.to_numeric(places["importance"], errors="coerce").fillna(0),
+    )
+
+    fields = {field: (places[field].astype(str).tolist(), weight) for field, weight in GAZETTEER_FIELD_WEIGHTS.items()}
+    tiebreak = list(zip((-places["importance"]).tolist(), places["name"].astype(str).tolist()))
+
+    return places, build_search_index(fields, tiebreak)
+
+
+def get_gazetteer_path():
+    """Path of the optional place extract to load alongside the built-in places."""
+    return get_setting("gazetteer_path")
+
+
+def get_gazetteer(extract_path=None, stores_path=WALMART_CSV):
+    """
+    The place table and index. A missing or unreadable extract is logged and skipped, so
+    the built-in places (and the Nominatim fallback) keep working.
+    """
+    stores_mtime = os.path.getmtime(stores_path)
+    if extract_path:
+        try:
+            return _build_gazetteer(extract_path, os.path.getmtime(extract_path), stores_path, stores_mtime)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Skipping gazetteer extract %s: %s", extract_path, e)
+
+    return _build_gazetteer(None, None, stores_path, stores_mtime)
+
+
+def gazetteer_place_id(row):
+    return f"gazetteer_{row}"
+
+
+def is_prefix_match(text, query):
+    """
+    Whether `query` starts with `text` ("conway ar" for Conway) or is the start of it
+    ("conw"), rather than only matching words elsewhere in it.
+    """
+    name_tokens = tokenize(text)
+    query_tokens = [token for token in tokenize(query) if token not in GAZETTEER_STOPWORDS]
+    if not query_tokens:
+        return False
+    if query_tokens[:len(name_tokens)] == name_tokens:
+        return True
+
+    *typed, last = query_tokens
+    return (
+        len(query_tokens) <= len(name_tokens)
+        and name_tokens[:len(typed)] == typed
+        and name_tokens[len(typed)].startswith(last)
+    )
+
+
+def search_places(query, limit=5, extract_path=None, names_only=True):
+    """
+    Return up to `limit` places matching every token in `query`, best first. Unless
+    `names_only` is False, only places whose name or address the query starts with count:
+    "boston" and "new york" match New Boston, OH and towns in New York state, not Boston
+    or New York City, so they're left to Nominatim, as are street addresses:
+
+    >>> [place["description"] for place in search_places("conway ar", limit=2)]
+    ['Conway, AR', 'Conway, AR 72034']
+    >>> search_places("Pennsylvania Ave"), search_places("1600 Pennsylvania")
+    ([], [])
+    >>> search_places("boston"), search_places("new york")
+    ([], [])
+    >>> [place["description"] for place in search_places("boston", limit=2, names_only=False)]
+    ['New Boston, OH', 'New Boston, TX']
+    """
+    places, index = get_gazetteer(extract_path)
+    # Street addresses aren't in the gazetteer, so don't let their words match places by
+    # substring ("ave" in "Beaver Falls") or a house number match a zip code prefix
+    # ("1600" in 16001); those queries should fall through to Nominatim.
+    rows = rank(
+        index,
+        query,
+        limit=None if names_only else limit,
+        stopwords=GAZETTEER_STOPWORDS,
+        substring=False,
+        prefix_last_only=True,
+    )
+    if names_only:
+        names, addresses = places["name"], places["address"]
+        rows = [
+            row for row in rows
+            if is_prefix_match(names.iat[row], query) or is_prefix_match(addresses.iat[row], query)
+        ][:limit]
+
+    return [
+        {
+            "description": places["address"].iat[row] or places["name"].iat[row],
+            "place_id": gazetteer_place_id(row),
+        }
+        for row in rows
+    ]
+
+
+def get_place(place_id, extract_path=None):
+    """Return the place row for a `gazetteer_<row>` place_id, or None if there's no such place."""
+    places, _ = get_gazetteer(extract_path)
+    row = place_id.removeprefix("gazetteer_")
+    if not row.isdigit() or int(row) >= len(places):
+        return None
+
+    return places.iloc[int(row)]
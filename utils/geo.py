@@ -0,0 +1,80 @@
+# utils/geo.py
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE_LAT = 111195.0
+
+
+def haversine_meters(lat, lon, lats, lons):
+    """Great-circle distance in meters from (lat, lon) to each of `lats`/`lons` (numpy arrays)."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bounding_box(lat, lon, radius_meters):
+    """Return (min_lat, max_lat, min_lon, max_lon) enclosing a circle around (lat, lon)."""
+    dlat = radius_meters / METERS_PER_DEGREE_LAT
+    cos_lat = np.cos(np.radians(lat))
+    # Near the poles (or for huge radii) the circle spans every longitude
+    dlon = 180.0 if cos_lat < 1e-6 else min(dlat / cos_lat, 180.0)
+
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lon, precision):
+    """Standard base-32 geohash of (lat, lon) with `precision` characters."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits, bit_count, even = 0, 0, True
+
+    while len(geohash) < precision:
+        interval, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+
+    return "".join(geohash)
+
+
+def geohash_bounds(geohash):
+    """Return (min_lat, max_lat, min_lon, max_lon) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if bits >> shift & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def snap_to_geohash(lat, lon, precision):
+    """
+    Move (lat, lon) to the centre of its geohash cell, so every point in the cell gives the
+    same coordinates (and so the same API cache keys). Precision 6 cells are ~1.2 x 0.6km,
+    precision 7 ~150m.
+    """
+    min_lat, max_lat, min_lon, max_lon = geohash_bounds(geohash_encode(lat, lon, precision))
+    return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
@@ -0,0 +1,138 @@
+# utils/http.py
+import functools
+import os
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connection pool sizing shared by every session in the process. POOL_MAXSIZE is also a
+# per-host concurrency cap: once that many connections to a host are busy, further
+# requests wait for one to free up instead of opening more (pool_block=True).
+POOL_CONNECTIONS = 10  # hosts to keep a pool for
+POOL_MAXSIZE = 10  # connections per host
+
+# Clients whose connection reuse is reported by connection_stats(), by name
+_tracked_clients = {}
+# Requests per second allowed through each named session, set by set_rate_limit()
+_rate_limits = {}
+
+
+def track_connections(name, client):
+    """Include `client` (a requests.Session or CountingHTTPTransport) in connection_stats()."""
+    _tracked_clients[name] = client
+
+
+class RateLimiter:
+    """Spaces calls to acquire() at least 1/`requests_per_second` apart, across threads."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RateLimitedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that waits for its `rate_limiter` (if one is set) before each request."""
+
+    rate_limiter = None
+
+    def send(self, request, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return super().send(request, **kwargs)
+
+
+@functools.cache
+def get_http_session(name, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    """Process-wide requests.Session with keep-alive connection pools, one per `name`d API."""
+    session = requests.Session()
+    adapter = RateLimitedHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+    if _rate_limits.get(name):
+        adapter.rate_limiter = RateLimiter(_rate_limits[name])
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    track_connections(name, session)
+
+    return session
+
+
+def set_rate_limit(name, requests_per_second):
+    """Limit every request through the `name`d session to `requests_per_second` (None: no limit)."""
+    _rate_limits[name] = requests_per_second
+    limiter = RateLimiter(requests_per_second) if requests_per_second else None
+    for adapter in get_http_session(name).adapters.values():
+        adapter.rate_limiter = limiter
+
+
+def _reset_after_fork():
+    """
+    A forked process (e.g. a ProcessPoolExecutor worker) must not read from the keep-alive
+    sockets it inherited, or it and the parent can get each other's responses. Start it
+    with new sessions instead; rate limits carry over, but apply per process.
+    """
+    get_http_session.cache_clear()
+    _tracked_clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class CountingHTTPTransport(httpx.HTTPTransport):
+    """httpx transport that counts requests and newly opened connections."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.num_connections = 0
+
+        create_connection = self._pool.create_connection
+
+        def counting_create_connection(origin):
+            with self._lock:
+                self.num_connections += 1
+            return create_connection(origin)
+
+        self._pool.create_connection = counting_create_connection
+
+    def handle_request(self, request):
+        with self._lock:
+            self.num_requests += 1
+        return super().handle_request(request)
+
+
+def _counts(client):
+    if isinstance(client, requests.Session):
+        pools = {id(adapter): adapter.poolmanager.pools for adapter in client.adapters.values()}.values()
+        connection_pools = [container[key] for container in pools for key in container.keys()]
+        return (
+            sum(pool.num_requests for pool in connection_pools),
+            sum(pool.num_connections for pool in connection_pools),
+        )
+
+    return client.num_requests, client.num_connections
+
+
+def connection_stats():
+    """Requests made, connections opened and the connection reuse rate per tracked client."""
+    stats = {}
+    for name, client in list(_tracked_clients.items()):
+        num_requests, num_connections = _counts(client)
+        stats[name] = {
+            "requests": num_requests,
+            "connections": num_connections,
+            "reuse_rate": 1 - num_connections / num_requests if num_requests else 0.0,
+        }
+
+    return stats
@@ -0,0 +1,384 @@
+# utils/insights.py
+import datetime
+import functools
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from utils.cache import cache_get, cache_set, make_key
+from utils.http import set_rate_limit
+from utils.predicthq import (
+    ATTENDED_CATEGORIES,
+    EVENTS_SORT,
+    MAX_EVENTS,
+    fetch_events,
+    fetch_metrics,
+    fetch_suggested_radius,
+    quantize_query,
+    summarize_metrics,
+)
+from utils.walmart import (
+    STORE_RADIUS_COLUMNS,
+    STORE_RADIUS_CSV,
+    get_store_radius,
+    get_walmart_stores,
+    load_store_radius_table,
+    save_store_radius_table,
+)
+
+logger = logging.getLogger(__name__)
+
+# SQLite file the batch job writes to and the app can serve store insights from
+INSIGHTS_PATH = "store_insights.sqlite3"
+# Length of the insights period, starting today
+INSIGHTS_PERIOD_DAYS = 85
+DEFAULT_INDUSTRY = "accommodation"
+# How long the app keeps a loaded row in memory, so reruns don't unpickle it again
+INSIGHTS_MEMORY_TTL_SECONDS = 60 * 60
+# Stores processed at once, and the cap on PredictHQ requests per second across all of them
+BATCH_WORKERS = 4
+BATCH_REQUESTS_PER_SECOND = 5.0
+# Suggested radius rows older than this are fetched again by refresh_store_radii
+STORE_RADIUS_REFRESH_DAYS = 30
+# refresh_store_radii rewrites the table after this many new rows, so an interruption keeps most of them
+STORE_RADIUS_SAVE_EVERY = 500
+
+# Headline numbers stored as columns (the full events and metrics payloads are stored too)
+SUMMARY_COLUMNS = [
+    "phq_attendance_sum",
+    "previous_phq_attendance_sum",
+    "average_daily_attendance",
+    "previous_average_daily_attendance",
+    "attended_events_sum",
+    "non_attended_events_sum",
+    "previous_attended_events_sum",
+    "previous_non_attended_events_sum",
+]
+
+
+def insights_settings_key(industry=DEFAULT_INDUSTRY, max_events=MAX_EVENTS, geo_snap_precision=None, tz="UTC"):
+    """Identifies the query settings behind stored insights; the app only reuses rows that match its own."""
+    return make_key("store_insights", {
+        "industry": industry,
+        "max_events": max_events,
+        "geo_snap_precision": geo_snap_precision,
+        "tz": tz,
+        "categories": ATTENDED_CATEGORIES,
+        "sort": EVENTS_SORT,
+    })
+
+
+# Every open InsightsStore, so one fork handler can reset them all
+_insights_stores = weakref.WeakSet()
+
+
+def _reset_stores_after_fork():
+    for store in list(_insights_stores):
+        store._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_stores_after_fork)
+
+
+class InsightsStore:
+    """
+    Per-store insights in SQLite: one row per store, period and settings, with the headline
+    numbers as columns and the events and metrics payloads as compressed pickles. Each row
+    is committed as soon as it's saved, so an interrupted batch keeps its progress.
+    """
+
+    def __init__(self, path=INSIGHTS_PATH):
+        self.path = path
+        self._local = threading.local()
+        _insights_stores.add(self)
+        summary_columns = "".join(f"{column} REAL,\n" for column in SUMMARY_COLUMNS)
+        self._connection().execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS store_insights (
+                store_id TEXT NOT NULL,
+                date_from TEXT NOT NULL,
+                date_to TEXT NOT NULL,
+                settings_key TEXT NOT NULL,
+                name TEXT,
+                latitude REAL,
+                longitude REAL,
+                radius REAL,
+                radius_unit TEXT,
+                events_count INTEGER,
+                events_fetched INTEGER,
+                {summary_columns}
+                payload BLOB NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (store_id, date_from, date_to, settings_key)
+            )
+            """
+        )
+
+    def _reset_after_fork(self):
+        # Same as DiskCache: leave the inherited SQLite connections alone in a forked child
+        self._inherited = self._local
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def completed(self, date_from, date_to, settings_key):
+        """IDs of the stores that already have insights for this period and settings."""
+        rows = self._connection().execute(
+            "SELECT store_id FROM store_insights WHERE date_from = ? AND date_to = ? AND settings_key = ?",
+            (date_from.isoformat(), date_to.isoformat(), settings_key),
+        )
+        return {store_id for (store_id,) in rows}
+
+    def save(self, insights):
+        row = {key: value for key, value in insights.items() if key not in ("events", "metrics")}
+        row.update(
+            date_from=insights["date_from"].isoformat(),
+            date_to=insights["date_to"].isoformat(),
+            # The payload also keeps the radius exactly as the API returned it (int or float)
+            payload=zlib.compress(pickle.dumps(
+                {key: insights[key] for key in ("radius", "events", "metrics")}, protocol=pickle.HIGHEST_PROTOCOL
+            )),
+            updated=time.time(),
+        )
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        self._connection().execute(
+            f"INSERT OR REPLACE INTO store_insights ({columns}) VALUES ({placeholders})", tuple(row.values())
+        )
+
+    def load(self, store_id, date_from, date_to, settings_key):
+        """The stored insights for a store (summary fields plus events and metrics), or None."""
+        conn = self._connection()
+        cursor = conn.execute(
+            "SELECT * FROM store_insights WHERE store_id = ? AND date_from = ? AND date_to = ? AND settings_key = ?",
+            (store_id, date_from.isoformat(), date_to.isoformat(), settings_key),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        insights = dict(zip((column[0] for column in cursor.description), row))
+        insights.update(pickle.loads(zlib.decompress(insights.pop("payload"))))
+        insights["date_from"] = datetime.date.fromisoformat(insights["date_from"])
+        insights["date_to"] = datetime.date.fromisoformat(insights["date_to"])
+        return insights
+
+    def summaries(self):
+        """Every stored row without its payload, as a DataFrame."""
+        return pd.read_sql_query("SELECT * FROM store_insights", self._connection()).drop(columns="payload")
+
+
+@functools.cache
+def get_insights_store(path=INSIGHTS_PATH):
+    """The process-wide InsightsStore for `path`."""
+    return InsightsStore(path)
+
+
+def load_store_insights(store_id, date_from, date_to, settings_key, path=INSIGHTS_PATH):
+    """
+    Stored insights for a store, or None if the batch job hasn't stored any for this period
+    and settings (or hasn't run at all). A broken insights file is treated as a miss.
+    """
+    if not os.path.exists(path):
+        return None
+
+    params = {
+        "store_id": store_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "settings_key": settings_key,
+        "path": path,
+    }
+    insights = cache_get("store_insights", params, persist=False)
+    if insights is not None:
+        return insights
+
+    try:
+        insights = get_insights_store(path).load(store_id, date_from, date_to, settings_key)
+    except (sqlite3.Error, pickle.UnpicklingError, zlib.error, OSError) as e:
+        logger.warning("Reading stored insights failed for %s: %s", store_id, e)
+        return None
+    if insights is not None:
+        cache_set("store_insights", params, insights, INSIGHTS_MEMORY_TTL_SECONDS, persist=False)
+
+    return insights
+
+
+def compute_store_insights(
+    store, date_from, date_to, industry=DEFAULT_INDUSTRY, max_events=MAX_EVENTS, geo_snap_precision=None, tz="UTC"
+):
+    """
+    Run the app's pipeline for one store row: suggested radius (from the precomputed table
+    if it has the store), then events and metrics.
+    Goes through the same caches as the app, so it also warms them.
+    """
+    query_lat, query_lon, date_from, date_to = quantize_query(
+        float(store["latitude"]), float(store["longitude"]), date_from, date_to, precision=geo_snap_precision
+    )
+    radius, radius_unit = get_store_radius(store["store_id"], industry) or fetch_suggested_radius(
+        query_lat, query_lon, radius_unit="mi", industry=industry
+    )
+    events = fetch_events(
+        query_lat,
+        query_lon,
+        radius=radius,
+        date_from=date_from,
+        date_to=date_to,
+        tz=tz,
+        categories=ATTENDED_CATEGORIES,
+        radius_unit=radius_unit,
+        max_events=max_events,
+    )
+    metrics = fetch_metrics(query_lat, query_lon, radius, radius_unit, date_from, date_to, tz=tz)
+    summary = summarize_metrics(metrics, date_from, date_to)
+
+    return {
+        "store_id": store["store_id"],
+        "date_from": date_from,
+        "date_to": date_to,
+        "settings_key": insights_settings_key(industry, max_events, geo_snap_precision, tz),
+        "name": store["name"],
+        "latitude": float(store["latitude"]),
+        "longitude": float(store["longitude"]),
+        "radius": radius,
+        "radius_unit": radius_unit,
+        "events_count": events["count"],
+        "events_fetched": len(events["results"]),
+        **{column: float(summary[column]) for column in SUMMARY_COLUMNS},
+        "events": events,
+        "metrics": metrics,
+    }
+
+
+def run_batch(
+    store_ids=None,
+    date_from=None,
+    industry=DEFAULT_INDUSTRY,
+    max_events=MAX_EVENTS,
+    geo_snap_precision=None,
+    workers=BATCH_WORKERS,
+    requests_per_second=BATCH_REQUESTS_PER_SECOND,
+    limit=None,
+    resume=True,
+    path=INSIGHTS_PATH,
+):
+    """
+    Compute and store insights for the given stores (default: all of them), `workers` at a
+    time, with PredictHQ requests limited to `requests_per_second` overall. With `resume`,
+    stores already stored for this period and settings are skipped, so a rerun after an
+    interruption picks up where it stopped. Returns (stores saved, stores failed).
+    """
+    date_from = date_from or datetime.date.today()
+    date_to = date_from + datetime.timedelta(days=INSIGHTS_PERIOD_DAYS)
+    settings_key = insights_settings_key(industry, max_events, geo_snap_precision)
+
+    store = get_insights_store(path)
+    stores = get_walmart_stores()
+    if store_ids:
+        stores = stores[stores["store_id"].isin(store_ids)]
+    if resume:
+        stores = stores[~stores["store_id"].isin(store.completed(date_from, date_to, settings_key))]
+    if limit:
+        stores = stores.head(limit)
+
+    set_rate_limit("predicthq", requests_per_second)
+    logger.info("Computing insights for %d stores, %s to %s", len(stores), date_from, date_to)
+
+    saved = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                compute_store_insights, row, date_from, date_to, industry, max_events, geo_snap_precision
+            ): row["store_id"]
+            for _, row in stores.iterrows()
+        }
+        for future in as_completed(futures):
+            store_id = futures[future]
+            try:
+                store.save(future.result())
+                saved += 1
+            except Exception as e:
+                logger.warning("Store %s failed: %s", store_id, e)
+                failed += 1
+            if (saved + failed) % 50 == 0:
+                logger.info("%d/%d stores done (%d failed)", saved + failed, len(futures), failed)
+
+    return saved, failed
+
+
+def refresh_store_radii(
+    industries=(DEFAULT_INDUSTRY,),
+    store_ids=None,
+    workers=BATCH_WORKERS,
+    requests_per_second=BATCH_REQUESTS_PER_SECOND,
+    limit=None,
+    max_age_days=STORE_RADIUS_REFRESH_DAYS,
+    path=STORE_RADIUS_CSV,
+):
+    """
+    Fetch the suggested radius for every store and industry (default: all stores) that
+    has no row in the table at `path`, or one older than `max_age_days`, and save it
+    there. Rows are fetched at the store's own location. Returns (rows saved, rows failed).
+    """
+    radii = load_store_radius_table(path)
+    fresh = radii[radii["updated"] >= time.time() - max_age_days * 24 * 60 * 60]
+    fresh = set(zip(fresh["store_id"].tolist(), fresh["industry"].tolist()))
+
+    stores = get_walmart_stores()
+    if store_ids:
+        stores = stores[stores["store_id"].isin(store_ids)]
+    todo = [
+        (store_id, industry, float(lat), float(lon))
+        for store_id, lat, lon in zip(stores["store_id"].tolist(), stores["latitude"], stores["longitude"])
+        for industry in industries
+        if (store_id, industry) not in fresh
+    ][:limit]
+
+    set_rate_limit("predicthq", requests_per_second)
+    logger.info("Fetching the suggested radius for %d store/industry pairs", len(todo))
+
+    rows = []
+    failed = 0
+
+    def save():
+        # Newer rows replace older ones for the same store and industry
+        new_rows = pd.DataFrame(rows, columns=STORE_RADIUS_COLUMNS)
+        table = pd.concat([radii, new_rows], ignore_index=True) if len(radii) else new_rows
+        save_store_radius_table(table.drop_duplicates(["store_id", "industry"], keep="last"), path)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch_suggested_radius, lat, lon, radius_unit="mi", industry=industry): (store_id, industry)
+            for store_id, industry, lat, lon in todo
+        }
+        for future in as_completed(futures):
+            store_id, industry = futures[future]
+            try:
+                radius, radius_unit = future.result()
+            except Exception as e:
+                logger.warning("Suggested radius for store %s (%s) failed: %s", store_id, industry, e)
+                failed += 1
+                continue
+            rows.append((store_id, industry, radius, radius_unit, time.time()))
+            if len(rows) % STORE_RADIUS_SAVE_EVERY == 0:
+                save()
+                logger.info("%d/%d done (%d failed)", len(rows) + failed, len(futures), failed)
+
+    if rows:
+        save()
+
+    return len(rows), failed
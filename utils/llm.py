@@ -0,0 +1,118 @@
+# utils/llm.py
+import functools
+import io
+import os
+
+import httpx
+import pandas as pd
+from groq import Groq
+
+from utils.config import get_setting
+from utils.http import POOL_MAXSIZE, CountingHTTPTransport, track_connections
+
+GROQ_TIMEOUT_SECONDS = httpx.Timeout(60.0, connect=5.0)
+
+
+@functools.cache
+def _groq_client(api_key, max_connections=POOL_MAXSIZE):
+    transport = CountingHTTPTransport(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+    track_connections("groq", transport)
+
+    return Groq(
+        api_key=api_key,
+        timeout=GROQ_TIMEOUT_SECONDS,
+        http_client=httpx.Client(transport=transport, timeout=GROQ_TIMEOUT_SECONDS),
+    )
+
+
+# A forked process gets its own Groq client rather than sharing the parent's connections
+os.register_at_fork(after_in_child=_groq_client.cache_clear)
+
+
+def get_groq_client():
+    """The process-wide Groq client, reusing keep-alive connections across sessions."""
+    return _groq_client(get_setting("groq_api_key"))
+
+
+# Columns of the product table the demand prompt asks for (lower-cased), and the typed
+# columns they're parsed into. Units move from the values into the column names.
+PRODUCT_TABLE_COLUMNS = {
+    "product name": "Product Name",
+    "category": "Category",
+    "current stock": "Current Stock",
+    "recommended increase": "Recommended Increase (%)",
+    "projected demand": "Projected Demand",
+    "price point": "Price Point ($)",
+    "profit margin": "Profit Margin (%)",
+}
+PRODUCT_INTEGER_COLUMNS = ["Current Stock", "Projected Demand"]
+PRODUCT_FLOAT_COLUMNS = ["Recommended Increase (%)", "Price Point ($)", "Profit Margin (%)"]
+NUMBER_PATTERN = r"(-?\d+(?:\.\d+)?)"
+
+
+def extract_product_csv(raw_output):
+    """
+    The CSV product table in an LLM response, or None if it doesn't have one: the header
+    line (starting "Product Name,") and the comma-separated lines that follow it, whether
+    or not the model wrapped them in a code fence or quotes.
+    """
+    lines = raw_output.splitlines()
+    start = next(
+        (i for i, line in enumerate(lines) if line.strip().strip('"').lower().startswith("product name,")),
+        None,
+    )
+    if start is None:
+        return None
+
+    table = []
+    for line in lines[start:]:
+        line = line.strip()
+        if "," not in line or line.startswith("```"):
+            break
+        table.append(line)
+
+    return "\n".join(table)
+
+
+def _extract_numbers(values):
+    """The first number in each value ("$1,299.00" -> 1299.0, "+75%" -> 75.0), NaN if none."""
+    numbers = values.astype("string").str.replace(",", "", regex=False).str.extract(NUMBER_PATTERN, expand=False)
+    return pd.to_numeric(numbers)
+
+
+def parse_product_table(csv_data):
+    """
+    Parse the model's product CSV into a typed DataFrame with the PRODUCT_TABLE_COLUMNS.
+    Unknown columns are dropped, missing ones are left empty, and malformed rows skipped.
+    """
+    table = pd.read_csv(io.StringIO(csv_data), dtype=str, on_bad_lines="skip", skipinitialspace=True)
+    table = table.rename(columns=lambda column: PRODUCT_TABLE_COLUMNS.get(column.strip().lower(), column))
+    table = table.reindex(columns=list(PRODUCT_TABLE_COLUMNS.values()))
+    table = table.dropna(subset=["Product Name"])
+
+    table = table.assign(
+        **{column: table[column].astype("string").str.strip() for column in ["Product Name", "Category"]},
+        **{column: _extract_numbers(table[column]).round().astype("Int64") for column in PRODUCT_INTEGER_COLUMNS},
+        **{column: _extract_numbers(table[column]).astype("Float64") for column in PRODUCT_FLOAT_COLUMNS},
+    )
+    # Rows without a single number are prose the model slipped in, not products
+    has_numbers = table[PRODUCT_INTEGER_COLUMNS + PRODUCT_FLOAT_COLUMNS].notna().any(axis=1)
+
+    return table[has_numbers].reset_index(drop=True)
+
+
+@functools.lru_cache(maxsize=256)
+def product_table(raw_output):
+    """
+    The typed product table of an LLM response, or None if it has none. Cached on the
+    response text so reruns showing the same forecast don't parse it again; treat the
+    returned DataFrame as read-only.
+    """
+    csv_data = extract_product_csv(raw_output)
+    if not csv_data:
+        return None
+
+    products = parse_product_table(csv_data)
+    return None if products.empty else products
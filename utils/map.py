@@ -1,70 +1,196 @@
 # map.py
 import streamlit as st
 import pydeck as pdk
+import functools
+import math
+import os
+import numpy as np
 import pandas as pd
+from utils.geo import bounding_box
+from utils.walmart import WALMART_CSV, get_walmart_stores, find_walmart_stores_within
 
-def show_map(lat, lon, radius_meters, events):
-    COLOR_RANGE = [
-        [255, 174, 0],
-        [255, 138, 25],
-        [255, 104, 49],
-        [255, 69, 74],
-        [255, 35, 100],
-    ]
-
-    BREAKS = [20, 40, 60, 80, 100]
-
-    def color_scale(val):
-        for i, b in enumerate(BREAKS):
-            if val < b:
-                return COLOR_RANGE[i]
-        return COLOR_RANGE[i]
-
-    # Load Walmart data from CSV
-    walmart_data = pd.read_csv("walmart_2018_11_06.csv")
-    
-    # Prepare Walmart locations
-    walmart_features = []
-    for _, row in walmart_data.iterrows():
-        walmart_features.append({
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": [row['longitude'], row['latitude']]
-            },
-            "name": row['name'],
-            "address": f"{row['street_address']}, {row['city']}, {row['state']} {row['zip_code']}",
-            "phone": row['phone_number_1'],
-            "hours": row['open_hours'],
-            "url": row['url']
-        })
-
-    geojson_features = []
-
-    for event in events.get("results", []):
-        geojson_features.append(
-            {
-                "type": "Feature",
-                "geometry": event["geo"]["geometry"],
-                # NOTE: Not valid GeoJSON, but required for pydeck tooltips (which cannot use properties.* format)
-                "title": event["title"],
-                "id": event["id"],
-                "title": event["title"],
-                "phq_attendance": event["phq_attendance"]
-                if event["phq_attendance"]
-                else "0",
-                "phq_attendance_formatted": "{:,}".format(event["phq_attendance"])
-                if event["phq_attendance"]
-                else "0",
-                "phq_rank": event["rank"],
-                "local_rank": event["local_rank"],
-                "category": event["category"],
-                "fill_color": color_scale(
-                    event["local_rank"] if event["local_rank"] else 0
-                ),
-            }
+INITIAL_ZOOM = 14
+# Assumed width of the map canvas in pixels. Deliberately generous so stores just
+# off-screen are still there after a little panning.
+VIEWPORT_PIXELS = 1600
+
+# Event fill colour by local rank: values below BREAKS[i] get COLOR_RANGE[i]
+COLOR_RANGE = [
+    [255, 174, 0],
+    [255, 138, 25],
+    [255, 104, 49],
+    [255, 69, 74],
+    [255, 35, 100],
+]
+BREAKS = [20, 40, 60, 80, 100]
+
+# Below DETAIL_ZOOM, stores and point events are drawn as one aggregate per grid cell.
+# Each zoom level in CLUSTER_ZOOMS gets its own grid, about CLUSTER_CELL_PIXELS wide on screen.
+DETAIL_ZOOM = 11
+CLUSTER_ZOOMS = range(3, DETAIL_ZOOM)
+CLUSTER_CELL_PIXELS = 64
+
+
+def viewport_radius_meters(lat, zoom=INITIAL_ZOOM, pixels=VIEWPORT_PIXELS):
+    """Approximate distance from the centre to the edge of a `pixels`-wide Web Mercator view."""
+    meters_per_pixel = 156543.03392 * math.cos(math.radians(lat)) / 2**zoom
+    return meters_per_pixel * pixels / 2
+
+
+def color_scale(values):
+    """Vectorized lookup of COLOR_RANGE for an array of local ranks."""
+    bins = np.minimum(np.searchsorted(BREAKS, values, side="right"), len(COLOR_RANGE) - 1)
+    return [COLOR_RANGE[i] for i in bins]
+
+
+@functools.lru_cache(maxsize=1)
+def _build_walmart_layer_data(path, mtime):
+    """Tooltip-ready columns for every store, built once per CSV version and shared by all sessions."""
+    stores = get_walmart_stores(path)
+
+    return pd.DataFrame({
+        "longitude": stores["longitude"].astype("float64"),
+        "latitude": stores["latitude"].astype("float64"),
+        "name": stores["name"],
+        "address": (
+            stores["street_address"] + ", " + stores["city"].astype("string") + ", "
+            + stores["state"].astype("string") + " " + stores["zip_code"]
+        ),
+        "phone": stores["phone_number_1"],
+        "hours": stores["open_hours"],
+        "url": stores["url"],
+    })
+
+
+def cluster_level(zoom):
+    """The CLUSTER_ZOOMS grid to use for a map shown at `zoom`."""
+    return min(max(int(zoom), CLUSTER_ZOOMS.start), CLUSTER_ZOOMS.stop - 1)
+
+
+def aggregate_points(points, zoom, sums=(), means=()):
+    """
+    Aggregate a DataFrame with longitude/latitude columns onto the grid for `zoom`, giving one
+    row per non-empty cell with its centroid, point count, and the totals of `sums` and
+    averages of `means` columns.
+    """
+    cell_degrees = CLUSTER_CELL_PIXELS * 360 / (256 * 2**zoom)
+    cells = points.assign(
+        lat_cell=np.floor(points["latitude"] / cell_degrees).astype("int32"),
+        lon_cell=np.floor(points["longitude"] / cell_degrees).astype("int32"),
+    )
+    aggregations = {
+        "longitude": ("longitude", "mean"),
+        "latitude": ("latitude", "mean"),
+        "count": ("longitude", "size"),
+    }
+    aggregations.update({column: (column, "sum") for column in sums})
+    aggregations.update({column: (column, "mean") for column in means})
+    clusters = cells.groupby(["lat_cell", "lon_cell"]).agg(**aggregations).reset_index(drop=True)
+
+    # Circle size in pixels grows with the square root of the count so area tracks density
+    return clusters.assign(radius=np.minimum(6 + 4 * np.sqrt(clusters["count"]), 40))
+
+
+@functools.lru_cache(maxsize=1)
+def _build_walmart_cluster_pyramid(path, mtime):
+    """Store aggregates for every zoom in CLUSTER_ZOOMS, built once per CSV version."""
+    layer_data = _build_walmart_layer_data(path, mtime)
+    pyramid = {}
+    for zoom in CLUSTER_ZOOMS:
+        clusters = aggregate_points(layer_data, zoom)
+        # Fill the deck tooltip's fields so clusters don't show raw {placeholders}
+        pyramid[zoom] = clusters.assign(
+            title=clusters["count"].map("{:,} Walmart stores".format),
+            phq_attendance_formatted="",
+            phq_rank="",
+            local_rank="",
+            category="",
         )
 
+    return pyramid
+
+
+def walmart_layer_data(lat, lon, radius_meters, show_all_stores=False, zoom=INITIAL_ZOOM):
+    if zoom < DETAIL_ZOOM:
+        clusters = _build_walmart_cluster_pyramid(WALMART_CSV, os.path.getmtime(WALMART_CSV))[cluster_level(zoom)]
+        if show_all_stores:
+            return clusters
+
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, viewport_radius_meters(lat, zoom))
+        in_view = clusters["latitude"].between(min_lat, max_lat) & clusters["longitude"].between(min_lon, max_lon)
+        return clusters[in_view]
+
+    layer_data = _build_walmart_layer_data(WALMART_CSV, os.path.getmtime(WALMART_CSV))
+    if show_all_stores:
+        return layer_data
+
+    # Only ship the stores the initial view (or the search radius) can show
+    nearby = find_walmart_stores_within(lat, lon, max(radius_meters, viewport_radius_meters(lat, zoom)))
+    return layer_data.loc[nearby.index]
+
+
+def event_cluster_layer_data(event_points, zoom):
+    """Aggregate point events for a zoomed-out map, summing attendance and colouring by mean local rank."""
+    numeric = event_points.assign(local_rank=pd.to_numeric(event_points["local_rank"]).fillna(0))
+    clusters = aggregate_points(numeric, cluster_level(zoom), sums=["phq_attendance"], means=["local_rank"])
+
+    return clusters.assign(
+        title=clusters["count"].map("{:,} events".format),
+        phq_attendance_formatted=clusters["phq_attendance"].map("{:,.0f}".format),
+        phq_rank="",
+        local_rank=clusters["local_rank"].round().astype("int64"),
+        category="",
+        fill_color=color_scale(clusters["local_rank"].to_numpy()),
+    )
+
+
+def event_layer_data(events):
+    """
+    Split events into a DataFrame of point events and a list of polygon features in one pass.
+    Tooltip fields sit at the top level of each record (not valid GeoJSON for the polygons,
+    but pydeck tooltips cannot use the properties.* format).
+    """
+    results = pd.DataFrame.from_records(
+        events.get("results", []),
+        columns=["id", "title", "phq_attendance", "rank", "local_rank", "category", "geo"],
+    )
+    geometry = results["geo"].str["geometry"]
+    attendance = results["phq_attendance"].fillna(0).astype("int64")
+    local_rank = results["local_rank"].astype("Int64")
+
+    events_df = pd.DataFrame({
+        "geometry": geometry,
+        "id": results["id"],
+        "title": results["title"],
+        "phq_attendance": attendance,
+        "phq_attendance_formatted": attendance.map("{:,}".format),
+        "phq_rank": results["rank"],
+        # Missing ranks must serialise as null, not NaN
+        "local_rank": local_rank.astype(object).where(local_rank.notna(), None),
+        "category": results["category"],
+        "fill_color": color_scale(local_rank.fillna(0).to_numpy()),
+    })
+
+    is_point = (geometry.str["type"] == "Point").to_numpy(dtype=bool)
+    points = events_df[is_point]
+    coordinates = points["geometry"].str["coordinates"]
+    points = points.drop(columns="geometry").assign(
+        longitude=coordinates.str[0].astype("float64"),
+        latitude=coordinates.str[1].astype("float64"),
+    )
+    polygons = events_df[~is_point].assign(type="Feature").to_dict("records")
+
+    return points, polygons
+
+
+def show_map(lat, lon, radius_meters, events, show_all_stores=False, zoom=INITIAL_ZOOM):
+    walmart_data = walmart_layer_data(lat, lon, radius_meters, show_all_stores=show_all_stores, zoom=zoom)
+    event_points, event_polygons = event_layer_data(events)
+
+    clustered = zoom < DETAIL_ZOOM
+    if clustered:
+        event_points = event_cluster_layer_data(event_points, zoom)
+
     st.pydeck_chart(
         pdk.Deck(
             # *** ADDED/MODIFIED LINES ***
@@ -84,7 +210,7 @@ def show_map(lat, lon, radius_meters, events):
             initial_view_state=pdk.ViewState(
                 latitude=lat,
                 longitude=lon,
-                zoom=14,
+                zoom=zoom,
             ),
             layers=[
                 # Radius layer
@@ -118,9 +244,11 @@ def show_map(lat, lon, radius_meters, events):
                 # Walmart locations layer
                 pdk.Layer(
                     "ScatterplotLayer",
-                    data=walmart_features,
-                    get_position="geometry.coordinates",
-                    get_radius=100,
+                    data=walmart_data,
+                    get_position=["longitude", "latitude"],
+                    # Clusters are sized in pixels by store count; single stores are 100m dots
+                    get_radius="radius" if clustered else 100,
+                    radius_units="pixels" if clustered else "meters",
                     get_fill_color=[255, 255, 0, 180],  # Yellow color for Walmart locations
                     pickable=True,
                     auto_highlight=True,
@@ -136,28 +264,22 @@ def show_map(lat, lon, radius_meters, events):
                 ),
                 # Point-type events layer
                 pdk.Layer(
-                    "GeoJsonLayer",
-                    data=list(
-                        filter(
-                            lambda x: x["geometry"]["type"] == "Point", geojson_features
-                        )
-                    ),
+                    "ScatterplotLayer",
+                    data=event_points,
+                    get_position=["longitude", "latitude"],
                     auto_highlight=True,
                     pickable=True,
                     filled=True,
                     get_fill_color="fill_color",
                     stroked=False,
                     opacity=0.8,
-                    get_point_radius=20,
+                    get_radius="radius" if clustered else 20,
+                    radius_units="pixels" if clustered else "meters",
                 ),
                 # Polygon-type events layer
                 pdk.Layer(
                     "GeoJsonLayer",
-                    data=list(
-                        filter(
-                            lambda x: x["geometry"]["type"] != "Point", geojson_features
-                        )
-                    ),
+                    data=event_polygons,
                     auto_highlight=True,
                     pickable=True,
                     filled=True,
@@ -1,87 +1,31 @@
 import streamlit as st
 # import datetime
-# import pandas as pd
+import pandas as pd
 from utils.predicthq import (
-    fetch_features,
-    fetch_event_counts,
-    calc_sum_of_features,
-    calc_sum_of_event_counts,
-    ATTENDED_CATEGORIES,
-    NON_ATTENDED_CATEGORIES,
-    PHQ_ATTENDANCE_FEATURES,
+    fetch_metrics,
+    summarize_metrics,
 )
 from utils.map import show_map
 
 
 def show_metrics(
-    lat, lon, radius, radius_unit, date_from, date_to, suggested_radius, tz="UTC"
+    lat, lon, radius, radius_unit, date_from, date_to, suggested_radius, tz="UTC", metrics=None
 ):
-    # Work out previous date range for delta comparisons
-    previous_date_from = date_from - (date_to - date_from)
-    previous_date_to = date_from
-
-    # Fetch sum of Predicted Attendance
-    phq_attendance_features = fetch_features(
-        lat,
-        lon,
-        radius,
-        date_from=date_from,
-        date_to=date_to,
-        features=PHQ_ATTENDANCE_FEATURES,
-        radius_unit=radius_unit,
-    )
-    phq_attendance_sum = calc_sum_of_features(
-        phq_attendance_features, PHQ_ATTENDANCE_FEATURES
-    )
-
-    # Fetch previous predicted attendance
-    previous_phq_attendance_features = fetch_features(
-        lat,
-        lon,
-        radius,
-        date_from=previous_date_from,
-        date_to=previous_date_to,
-        features=PHQ_ATTENDANCE_FEATURES,
-        radius_unit=radius_unit,
-    )
-    previous_phq_attendance_sum = calc_sum_of_features(
-        previous_phq_attendance_features, PHQ_ATTENDANCE_FEATURES
-    )
-
-    # Work out average daily predicted attendance
-    days = (date_to - date_from).days
-    average_daily_attendance = phq_attendance_sum / days
-    previous_average_daily_attendance = previous_phq_attendance_sum / days
-
-    # Fetch event counts/stats
-    counts = fetch_event_counts(
-        lat,
-        lon,
-        radius,
-        date_from=date_from,
-        date_to=date_to,
-        tz=tz,
-        radius_unit=radius_unit,
-    )
-    attended_events_sum = calc_sum_of_event_counts(counts, ATTENDED_CATEGORIES)
-    non_attended_events_sum = calc_sum_of_event_counts(counts, NON_ATTENDED_CATEGORIES)
-
-    # Fetch event counts/stats for previous period
-    previous_counts = fetch_event_counts(
-        lat,
-        lon,
-        radius,
-        date_from=previous_date_from,
-        date_to=previous_date_to,
-        tz=tz,
-        radius_unit=radius_unit,
-    )
-    previous_attended_events_sum = calc_sum_of_event_counts(
-        previous_counts, ATTENDED_CATEGORIES
-    )
-    previous_non_attended_events_sum = calc_sum_of_event_counts(
-        previous_counts, NON_ATTENDED_CATEGORIES
-    )
+    """Render the headline metrics. Pass `metrics` from fetch_metrics to reuse an earlier fetch."""
+    if metrics is None:
+        metrics = fetch_metrics(lat, lon, radius, radius_unit, date_from, date_to, tz=tz)
+
+    summary = summarize_metrics(metrics, date_from, date_to)
+    daily_attendance = summary["daily_attendance"]
+    phq_attendance_sum = summary["phq_attendance_sum"]
+    previous_phq_attendance_sum = summary["previous_phq_attendance_sum"]
+    average_daily_attendance = summary["average_daily_attendance"]
+    previous_average_daily_attendance = summary["previous_average_daily_attendance"]
+    attended_events_sum = summary["attended_events_sum"]
+    non_attended_events_sum = summary["non_attended_events_sum"]
+    previous_attended_events_sum = summary["previous_attended_events_sum"]
+    previous_non_attended_events_sum = summary["previous_non_attended_events_sum"]
+    current_period = slice(pd.Timestamp(date_from), pd.Timestamp(date_to))
 
     # Fetch Demand Surges
     # demand_surges = fetch_demand_surges(
@@ -167,6 +111,12 @@ def show_metrics(
     with col42:
         st.caption("Difference to previous 90 day period")
 
+    # Daily attendance comes for free with the single features request
+    st.area_chart(
+        daily_attendance[current_period].rename("Predicted Attendance"),
+        color="#0071CE",
+    )
+
     # with col5:
     #     delta_pct = calc_delta_pct(demand_surges_count, previous_demand_surges_count)
     #     st.metric(
@@ -1,63 +1,118 @@
 # utils/osm.py
-import streamlit as st
+import functools
+import os
+from geopy.adapters import RequestsAdapter
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
+from utils.cache import cached
+from utils.gazetteer import get_gazetteer_path, get_place, search_places
+from utils.http import POOL_CONNECTIONS, POOL_MAXSIZE, track_connections
 
-# Initialize Nominatim geocoder
-# user_agent is required and should be unique to your app
-geolocator = Nominatim(user_agent="walmart-demand-forecasting-app-v1")
+# Geocoding results barely change; keep them for a day (in memory only)
+OSM_CACHE_TTL_SECONDS = 24 * 60 * 60
 
-# Add rate limiting to avoid getting blocked (1 request per second)
-geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
-reverse = RateLimiter(geolocator.reverse, min_delay_seconds=1)
 
-@st.cache_data
-def osm_autocomplete(address):
+def _init_geocoder():
     """
-    Get autocomplete suggestions from Nominatim.
-    Nominatim's 'geocode' with limit=5 works well for this.
+    Create the Nominatim geocoder and its rate-limited calls. Run again in forked processes,
+    which mustn't share the parent's keep-alive connections.
+    """
+    global geolocator, geocode, reverse
+
+    # Initialize Nominatim geocoder
+    # user_agent is required and should be unique to your app
+    geolocator = Nominatim(
+        user_agent="walmart-demand-forecasting-app-v1",
+        adapter_factory=functools.partial(
+            RequestsAdapter, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=True
+        ),
+    )
+    track_connections("nominatim", geolocator.adapter.session)
+
+    # Add rate limiting to avoid getting blocked (1 request per second)
+    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+    reverse = RateLimiter(geolocator.reverse, min_delay_seconds=1)
+
+
+_init_geocoder()
+os.register_at_fork(after_in_child=_init_geocoder)
+
+def _place_details(name, lat, lng, formatted_address):
+    """Format a place to match the structure our app expects"""
+    return {
+        "result": {
+            "geometry": {
+                "location": {
+                    "lat": lat,
+                    "lng": lng
+                }
+            },
+            "name": name,
+            "formatted_address": formatted_address
+        }
+    }
+
+def local_autocomplete(address, limit=5, names_only=True):
+    """
+    Get autocomplete suggestions from the local gazetteer only. Cities and zip codes
+    resolve locally, with no rate limit and no network.
+    """
+    places = search_places(address, limit=limit, extract_path=get_gazetteer_path(), names_only=names_only)
+    return [(place["description"], place["place_id"]) for place in places]
+
+@cached("osm_autocomplete", ttl=OSM_CACHE_TTL_SECONDS, persist=False)
+def osm_autocomplete(address, limit=5):
+    """
+    Get autocomplete suggestions, from the local gazetteer if a place's name matches and
+    otherwise from Nominatim. Nominatim's 'geocode' with limit=5 works well for this.
+    Places that only match on other words ("boston" in New Boston, OH) are suggested
+    when Nominatim finds nothing.
     """
     if not address or len(address) < 3:
         return []
-    
-    try:
-        # We ask for 5 results, exactly_one=False
-        locations = geocode(address, exactly_one=False, limit=5)
-        if not locations:
-            return []
-        
-        # Format for st_searchbox: (description, place_id)
-        # We'll use the full address as the 'place_id' for simplicity
-        return [(loc.address, loc.address) for loc in locations]
-    
-    except Exception as e:
-        st.error(f"Geocoding error: {e}")
-        return []
 
-@st.cache_data
+    places = local_autocomplete(address, limit=limit)
+    if places:
+        return places
+
+    # We ask for `limit` results, exactly_one=False
+    locations = geocode(address, exactly_one=False, limit=limit)
+    if not locations:
+        return local_autocomplete(address, limit=limit, names_only=False)
+
+    # Format for st_searchbox: (description, place_id)
+    # Nominatim already resolved the coordinates; carry them in the place_id so picking a
+    # suggestion doesn't geocode the same address again, however long ago it was suggested
+    return [(loc.address, nominatim_place_id(loc.latitude, loc.longitude, loc.address)) for loc in locations]
+
+
+def nominatim_place_id(lat, lng, address):
+    return f"nominatim_{lat},{lng}_{address}"
+
+@cached("osm_details", ttl=OSM_CACHE_TTL_SECONDS, persist=False)
 def get_osm_details(address):
     """
     Get details for a specific address.
-    Since we used the address as the 'place_id', we just geocode it again.
+    Gazetteer places and Nominatim suggestions (`nominatim_<lat>,<lng>_<address>`)
+    resolve locally; anything else is geocoded.
     """
-    try:
-        location = geocode(address)
-        if not location:
+    if address.startswith("nominatim_"):
+        coordinates, address = address.removeprefix("nominatim_").split("_", 1)
+        lat, lng = (float(value) for value in coordinates.split(","))
+        return _place_details(address.split(',')[0], lat, lng, address)
+
+    if address.startswith("gazetteer_"):
+        place = get_place(address, extract_path=get_gazetteer_path())
+        if place is None:
             return None
-        
-        # Format the result to match the structure our app expects
-        return {
-            "result": {
-                "geometry": {
-                    "location": {
-                        "lat": location.latitude,
-                        "lng": location.longitude
-                    }
-                },
-                "name": address.split(',')[0], # Use first part of address as name
-                "formatted_address": location.address
-            }
-        }
-    except Exception as e:
-        st.error(f"Geocoding error: {e}")
-        return None
\ No newline at end of file
+
+        return _place_details(
+            place["name"], float(place["latitude"]), float(place["longitude"]), place["address"] or place["name"]
+        )
+
+    location = geocode(address)
+    if not location:
+        return None
+
+    # Use first part of address as name
+    return _place_details(address.split(',')[0], location.latitude, location.longitude, location.address)
@@ -1,7 +1,14 @@
 import datetime
+import pandas as pd
+import functools
 import requests
-import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 from predicthq import Client # type: ignore
+from predicthq.exceptions import ClientError, ServerError # type: ignore
+from utils.cache import cache_get, cache_set, cached
+from utils.config import get_setting
+from utils.geo import snap_to_geohash
+from utils.http import get_http_session
 
 
 ATTENDED_CATEGORIES = [
@@ -29,6 +36,42 @@ UNSCHEDULED_CATEGORIES = [
     "terror",
 ]
 
+# Per-request HTTP timeout (connect, read) in seconds, so one slow API call can't stall a page
+REQUEST_TIMEOUT_SECONDS = (5, 30)
+
+EVENTS_URL = "https://api.predicthq.com/v1/events/"
+# The Events API returns at most this many events per page
+EVENTS_PAGE_SIZE = 200
+# Default cap on events fetched per lookup, across all pages
+MAX_EVENTS = 1000
+# Highest predicted attendance first, so a `max_events` cap keeps the biggest events
+EVENTS_SORT = "-phq_attendance"
+# The only event fields the app reads. The Events API has no field selection, so
+# results are trimmed after download to keep cached payloads small.
+EVENT_FIELDS = [
+    "id",
+    "title",
+    "category",
+    "start",
+    "end",
+    "predicted_end",
+    "timezone",
+    "rank",
+    "local_rank",
+    "phq_attendance",
+    "entities",
+    "geo",
+    "predicted_event_spend",
+    "predicted_event_spend_industries",
+]
+# How long responses stay cached (in memory and on disk), per endpoint
+CACHE_TTL_SECONDS = {
+    "events": 6 * 60 * 60,
+    "features": 12 * 60 * 60,
+    "event_counts": 6 * 60 * 60,
+    "suggested_radius": 7 * 24 * 60 * 60,
+}
+
 # Some of the possible phq_attendance features are commented out below to match what
 # we do in our Location Insights product. You can uncomment them to include them in.
 PHQ_ATTENDANCE_FEATURES = [
@@ -45,18 +88,75 @@ PHQ_ATTENDANCE_FEATURES = [
 ]
 
 
+def quantize_query(lat, lon, date_from, date_to, precision=None):
+    """
+    Snap a query's origin to the centre of its geohash cell (when `precision` is set) and
+    its dates to day boundaries, so lookups close together on the same days share cached
+    responses. Costs up to half a cell of accuracy in the query origin.
+    """
+    if precision:
+        lat, lon = snap_to_geohash(lat, lon, precision)
+    if isinstance(date_from, datetime.datetime):
+        date_from = date_from.date()
+    if isinstance(date_to, datetime.datetime):
+        date_to = date_to.date()
+
+    return lat, lon, date_from, date_to
+
+
 def get_api_key():
-    return st.secrets["api_key"]
+    return get_setting("api_key")
+
+
+class PredictHQClient(Client):
+    """
+    The PredictHQ SDK client, sending requests through the shared keep-alive session
+    and with a timeout on each one (the SDK opens a new connection per request and
+    sets no timeout). Error handling matches Client.request.
+    """
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT_SECONDS)
+        headers = self.get_headers(kwargs.pop("headers", {}))
+        response = get_http_session("predicthq").request(method, self.build_url(path), headers=headers, **kwargs)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            try:
+                error = response.json()
+            except ValueError:
+                error = response.content
+
+            if 400 <= response.status_code <= 499:
+                raise ClientError(error)
+            else:
+                raise ServerError(error)
+
+        try:
+            return response.json() or None
+        except ValueError:
+            return None
+
+
+@functools.cache
+def _predicthq_client(api_key):
+    return PredictHQClient(access_token=api_key)
 
 
 def get_predicthq_client():
-    api_key = get_api_key()
-    phq = Client(access_token=api_key)
+    """The process-wide PredictHQ client for the configured API key."""
+    return _predicthq_client(get_api_key())
+
+
+@cached("suggested_radius", ttl=CACHE_TTL_SECONDS["suggested_radius"])
+def fetch_suggested_radius(lat, lon, radius_unit="mi", industry="parking"):
+    phq = get_predicthq_client()
+    suggested_radius = phq.radius.search(location__origin=f"{lat},{lon}", radius_unit=radius_unit, industry=industry)
 
-    return phq
+    return suggested_radius.radius, suggested_radius.radius_unit
 
 
-@st.cache_data
+@cached("features", ttl=CACHE_TTL_SECONDS["features"])
 def fetch_features(lat, lon, radius, date_from, date_to, features=[], radius_unit="mi"):
     """
     Features API only works with local time, so any date range used is based on the timezone
@@ -115,30 +215,90 @@ def fetch_features(lat, lon, radius, date_from, date_to, features=[], radius_uni
 
 #     return results
 
-@st.cache_data
+def _trim_event(event):
+    return {field: event[field] for field in EVENT_FIELDS if field in event}
+
+
+def iter_event_pages(
+    lat, lon, radius, date_from, date_to, tz="UTC", categories=[], radius_unit="mi", max_events=MAX_EVENTS
+):
+    """
+    Yield pages of events ({"count": total matching, "results": [...]}) as they arrive,
+    following the API's `next` link until there are no more pages or `max_events` have
+    been returned. Each event is trimmed to EVENT_FIELDS.
+    """
+    url = EVENTS_URL
+    params = {
+        "within" : f"{radius}{radius_unit}@{lat},{lon}",
+        "active.gte" : date_from,
+        "active.lte" : date_to,
+        "tz": tz,
+        "category" : ",".join(categories),
+        "state": "active",
+        "limit" : min(EVENTS_PAGE_SIZE, max_events),
+        "sort" : EVENTS_SORT,
+    }
+    fetched = 0
+
+    while url and fetched < max_events:
+        r = get_http_session("predicthq").get(
+            url=url,
+            headers={
+                "Authorization": f"Bearer {get_api_key()}",
+                "Accept": "application/json",
+            },
+            params=params,
+            allow_redirects=False,
+            timeout=REQUEST_TIMEOUT_SECONDS,
+        )
+        r.raise_for_status()
+        page = r.json()
+
+        results = [_trim_event(event) for event in page.get("results", [])[: max_events - fetched]]
+        fetched += len(results)
+        yield {"count": page.get("count", fetched), "results": results}
+
+        # The next link already carries the query string
+        url, params = page.get("next"), None
+
+
 def fetch_events(
-    lat, lon, radius, date_from, date_to, tz="UTC", categories=[], radius_unit="mi"
- ):
-    r = requests.get(
-        url="https://api.predicthq.com/v1/events/",
-        headers={
-            "Authorization": f"Bearer {get_api_key()}",
-            "Accept": "application/json",
-        },
-        params={
-            "within" : f"{radius}{radius_unit}@{lat},{lon}",
-            "active.gte" : date_from,
-            "active.lte" : date_to,
-            "tz": tz,
-            "category" : ",".join(categories),
-            "state": "active",
-            "limit" : 200,
-            "sort" : "phq_attendance",
-        },
-        allow_redirects=False,
-    )
-    
-    return r.json()
+    lat, lon, radius, date_from, date_to, tz="UTC", categories=[], radius_unit="mi",
+    max_events=MAX_EVENTS, on_page=None,
+):
+    """
+    Fetch every page of events (up to `max_events`). `on_page` is called with the events
+    accumulated so far after each page, so callers can render partial results while the
+    rest load. Only completed results are cached, so `on_page` is only called on a miss.
+    """
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "radius": radius,
+        "date_from": date_from,
+        "date_to": date_to,
+        "tz": tz,
+        "categories": categories,
+        "radius_unit": radius_unit,
+        "max_events": max_events,
+        "sort": EVENTS_SORT,
+    }
+    events = cache_get("events", params)
+    if events is not None:
+        return events
+
+    events = {"count": 0, "results": []}
+    for page in iter_event_pages(
+        lat, lon, radius, date_from, date_to, tz=tz, categories=categories, radius_unit=radius_unit,
+        max_events=max_events,
+    ):
+        events = {"count": page["count"], "results": events["results"] + page["results"]}
+        if on_page is not None:
+            on_page(events)
+
+    cache_set("events", params, events, CACHE_TTL_SECONDS["events"])
+
+    return events
 
 # @st.cache_data
 # def fetch_events(
@@ -165,7 +325,7 @@ def fetch_events(
 #     return events.dict()
 
 
-@st.cache_data
+@cached("event_counts", ttl=CACHE_TTL_SECONDS["event_counts"])
 def fetch_event_counts(
     lat, lon, radius, date_from, date_to, tz="UTC", radius_unit="mi"
 ):
@@ -183,18 +343,101 @@ def fetch_event_counts(
     return counts.dict()
 
 
-def calc_sum_of_features(features_result, features):
-    # sum up the attendance features
-    phq_attendance_sum = 0
+def calc_daily_feature_totals(features_result, features):
+    """Return a Series with the per-day sum of the given features, indexed by date (as Timestamps)."""
+    totals = {
+        item["date"]: sum(v["stats"]["sum"] or 0 for k, v in item.items() if k in features and v is not None)
+        for item in features_result["results"]
+    }
 
-    for item in features_result["results"]:
-        for k, v in item.items():
-            phq_attendance_sum += v["stats"]["sum"] if k in features else 0
+    daily_totals = pd.Series(totals, dtype="float64")
+    daily_totals.index = pd.to_datetime(daily_totals.index)
 
-    return phq_attendance_sum
+    return daily_totals.sort_index()
 
 
 def calc_sum_of_event_counts(counts_result, categories):
     counts = {k: v for k, v in counts_result["categories"].items() if k in categories}
 
     return sum(counts.values())
+
+
+def fetch_metrics(lat, lon, radius, radius_unit, date_from, date_to, tz="UTC"):
+    """
+    Fetch the attendance features and event counts for the selected period and the
+    equal-length period before it. Features come back per day, so a single request
+    covers both periods; the requests are independent, so they run concurrently.
+    """
+    # Work out previous date range for delta comparisons
+    previous_date_from = date_from - (date_to - date_from)
+    previous_date_to = date_from
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = {
+            # Daily Predicted Attendance over both periods
+            "phq_attendance_features": pool.submit(
+                fetch_features,
+                lat,
+                lon,
+                radius,
+                date_from=previous_date_from,
+                date_to=date_to,
+                features=PHQ_ATTENDANCE_FEATURES,
+                radius_unit=radius_unit,
+            ),
+            # Event counts/stats, current and previous
+            "counts": pool.submit(
+                fetch_event_counts,
+                lat,
+                lon,
+                radius,
+                date_from=date_from,
+                date_to=date_to,
+                tz=tz,
+                radius_unit=radius_unit,
+            ),
+            "previous_counts": pool.submit(
+                fetch_event_counts,
+                lat,
+                lon,
+                radius,
+                date_from=previous_date_from,
+                date_to=previous_date_to,
+                tz=tz,
+                radius_unit=radius_unit,
+            ),
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def summarize_metrics(metrics, date_from, date_to):
+    """
+    The headline numbers for a fetch_metrics result: attendance totals and daily averages
+    and event counts for the selected and previous periods, plus the daily attendance.
+    """
+    # Split the daily attendance into the two periods. Both ranges include date_from,
+    # matching the inclusive active.gte/lte ranges used for the event counts.
+    previous_date_from = date_from - (date_to - date_from)
+    daily_attendance = calc_daily_feature_totals(
+        metrics["phq_attendance_features"], PHQ_ATTENDANCE_FEATURES
+    )
+    current_period = slice(pd.Timestamp(date_from), pd.Timestamp(date_to))
+    phq_attendance_sum = daily_attendance[current_period].sum()
+    previous_phq_attendance_sum = daily_attendance[pd.Timestamp(previous_date_from):pd.Timestamp(date_from)].sum()
+
+    # Work out average daily predicted attendance
+    days = (date_to - date_from).days
+
+    return {
+        "daily_attendance": daily_attendance,
+        "phq_attendance_sum": phq_attendance_sum,
+        "previous_phq_attendance_sum": previous_phq_attendance_sum,
+        "average_daily_attendance": phq_attendance_sum / days,
+        "previous_average_daily_attendance": previous_phq_attendance_sum / days,
+        "attended_events_sum": calc_sum_of_event_counts(metrics["counts"], ATTENDED_CATEGORIES),
+        "non_attended_events_sum": calc_sum_of_event_counts(metrics["counts"], NON_ATTENDED_CATEGORIES),
+        "previous_attended_events_sum": calc_sum_of_event_counts(metrics["previous_counts"], ATTENDED_CATEGORIES),
+        "previous_non_attended_events_sum": calc_sum_of_event_counts(
+            metrics["previous_counts"], NON_ATTENDED_CATEGORIES
+        ),
+    }
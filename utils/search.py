@@ -0,0 +1,121 @@
+# utils/search.py
+import re
+from collections import defaultdict
+
+# Score of an exact token match relative to a prefix match, and of a substring match
+# (found via trigrams). Multiplied by the weight of the field the token matched in.
+EXACT_MATCH_BONUS = 2
+SUBSTRING_MATCH_SCORE = 1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def build_search_index(fields, tiebreak):
+    """
+    Build a token prefix/trigram autocomplete index.
+
+    `fields` maps each field name to (list of values, one per row; weight), and `tiebreak`
+    holds a sort key per row used to order equally scored rows. `prefixes` maps every prefix
+    of every token to {row: score}, pre-sorted by score and tiebreak so single-token queries
+    can take the first few entries. `trigrams` maps each trigram to the rows containing it,
+    for substring matches that aren't token prefixes.
+    """
+    prefix_scores = defaultdict(dict)
+    trigrams = defaultdict(set)
+    texts = []
+
+    for row in range(len(tiebreak)):
+        row_tokens = []
+        for values, weight in fields.values():
+            for token in tokenize(values[row]):
+                row_tokens.append(token)
+                for end in range(1, len(token) + 1):
+                    score = weight * (EXACT_MATCH_BONUS if end == len(token) else 1)
+                    postings = prefix_scores[token[:end]]
+                    if postings.get(row, 0) < score:
+                        postings[row] = score
+                for trigram in _trigrams(token):
+                    trigrams[trigram].add(row)
+        texts.append(" ".join(row_tokens))
+
+    prefixes = {
+        prefix: dict(sorted(postings.items(), key=lambda item: (-item[1], tiebreak[item[0]])))
+        for prefix, postings in prefix_scores.items()
+    }
+
+    return {
+        "prefixes": prefixes,
+        "trigrams": dict(trigrams),
+        "texts": texts,
+        "tiebreak": tiebreak,
+    }
+
+
+def _match_token(index, token, prefix=True, substring=True):
+    """
+    Return {row: score} for a single query token: rows with a word it's a prefix of (or,
+    without `prefix`, a word equal to it), falling back to substring matches if `substring`.
+    """
+    postings = index["prefixes"].get(token)
+    if postings is not None:
+        if prefix:
+            return postings
+        texts = index["texts"]
+        return {row: score for row, score in postings.items() if f" {token} " in f" {texts[row]} "}
+    if not substring or len(token) < 3:
+        return {}
+
+    # Not a prefix of any token, so fall back to a substring match ("onway" -> "Conway")
+    candidates = None
+    for trigram in _trigrams(token):
+        rows = index["trigrams"].get(trigram)
+        if not rows:
+            return {}
+        candidates = rows if candidates is None else candidates & rows
+    texts = index["texts"]
+    return {row: SUBSTRING_MATCH_SCORE for row in candidates if token in texts[row]}
+
+
+def rank(index, query, limit=10, stopwords=(), substring=True, prefix_last_only=False):
+    """
+    Return the row positions of the best `limit` rows matching every token in `query`.
+    With `prefix_last_only`, only the last token (the word still being typed) may match
+    as a prefix; earlier tokens must match whole words. `substring` allows substring
+    matches for tokens that match no word prefix.
+    """
+    tokens = list(dict.fromkeys(token for token in tokenize(query) if token not in stopwords))
+    if not tokens:
+        return []
+
+    matches = sorted(
+        (
+            _match_token(index, token, prefix=not prefix_last_only or i == len(tokens) - 1, substring=substring)
+            for i, token in enumerate(tokens)
+        ),
+        key=len,
+    )
+    if len(matches) == 1:
+        # Postings are already sorted by score
+        return list(matches[0])[:limit]
+
+    smallest, others = matches[0], matches[1:]
+    scores = {}
+    for row, score in smallest.items():
+        for postings in others:
+            other_score = postings.get(row)
+            if other_score is None:
+                break
+            score += other_score
+        else:
+            scores[row] = score
+
+    tiebreak = index["tiebreak"]
+    return sorted(scores, key=lambda row: (-scores[row], tiebreak[row]))[:limit]
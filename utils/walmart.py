@@ -1,54 +1,300 @@
 # utils/walmart.py
-import streamlit as st
+import os
+import functools
+import time
+import numpy as np
 import pandas as pd
+from utils.geo import METERS_PER_DEGREE_LAT, bounding_box, haversine_meters
+from utils.search import build_search_index, rank
 
-def search_walmart_stores(search_term):
-    try:
-        # Load Walmart data from CSV
-        walmart_data = pd.read_csv("walmart_2018_11_06.csv")
-        
-        # Filter stores that match the search term (case insensitive)
-        matches = walmart_data[walmart_data['name'].str.contains(search_term, case=False, na=False)]
-        
-        # Convert to list of dicts for easier processing
-        results = []
-        for _, row in matches.iterrows():
-            results.append({
-                "description": f"{row['name']} - {row['street_address']}, {row['city']}, {row['state']} {row['zip_code']}",
-                "place_id": f"walmart_{row['name'].replace(' ', '_')}",
-            })
-        
-        return results
-    except Exception as e:
-        st.error(f"Error loading Walmart data: {e}")
-        return []
+WALMART_CSV = "walmart_2018_11_06.csv"
+
+# Only the columns the app actually reads; the social/email columns are empty.
+WALMART_COLUMNS = [
+    "index",
+    "name",
+    "url",
+    "street_address",
+    "city",
+    "state",
+    "zip_code",
+    "phone_number_1",
+    "open_hours",
+    "latitude",
+    "longitude",
+]
+
+
+@functools.lru_cache(maxsize=1)
+def _load_walmart_stores(path, mtime):
+    """
+    Parse the Walmart CSV into a typed DataFrame. Cached at module level (not per Streamlit
+    session) and keyed on the file's mtime, so every session shares one copy and an
+    updated file is picked up on the next call.
+    """
+    stores = pd.read_csv(
+        path,
+        usecols=WALMART_COLUMNS,
+        dtype={
+            "index": "int32",
+            "name": "string",
+            "url": "string",
+            "street_address": "string",
+            "city": "category",
+            "state": "category",
+            "zip_code": "string",
+            "phone_number_1": "string",
+            "open_hours": "string",
+            "latitude": "float32",
+            "longitude": "float32",
+        },
+    )
+    # The CSV stores zip codes as integers, which drops the leading zero in the north-east.
+    stores["zip_code"] = stores["zip_code"].str.zfill(5)
+    # A handful of stores have no opening hours; keep the column JSON-serialisable for pydeck.
+    stores["open_hours"] = stores["open_hours"].fillna("")
+    # Stable, unique store ID: the Walmart store number from the URL, falling back to the CSV index.
+    # Store names are not unique (there are 23 "San Antonio Supercenter"s).
+    store_number = stores["url"].str.extract(r"/store/(\d+)/", expand=False)
+    stores["store_id"] = store_number.fillna("csv" + stores["index"].astype("string"))
+
+    return stores
+
+
+def get_walmart_stores(path=WALMART_CSV):
+    """Return the shared Walmart store table, reloading it only when the CSV changes."""
+    return _load_walmart_stores(path, os.path.getmtime(path))
+
+
+# Suggested radius per store and industry, precomputed by `batch_insights.py --radius-only`
+STORE_RADIUS_CSV = "walmart_suggested_radius.csv"
+STORE_RADIUS_COLUMNS = ["store_id", "industry", "radius", "radius_unit", "updated"]
+# Rows older than this are ignored, so a table that stops being refreshed falls back to the API
+STORE_RADIUS_MAX_AGE_DAYS = 90
+
+
+def load_store_radius_table(path=STORE_RADIUS_CSV):
+    """The precomputed suggested radius table, or an empty one if it hasn't been built."""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=STORE_RADIUS_COLUMNS)
+
+    return pd.read_csv(
+        path,
+        usecols=STORE_RADIUS_COLUMNS,
+        dtype={
+            "store_id": "string",
+            "industry": "string",
+            "radius": "float64",
+            "radius_unit": "string",
+            "updated": "float64",
+        },
+    )
+
+
+def save_store_radius_table(radii, path=STORE_RADIUS_CSV):
+    """Replace the suggested radius table; readers see either the old or the new file, never half of one."""
+    radii = radii[STORE_RADIUS_COLUMNS].sort_values(["store_id", "industry"], kind="stable")
+    radii.to_csv(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_store_radii(path, mtime):
+    """Map (store_id, industry) to (radius, radius_unit, updated)."""
+    radii = load_store_radius_table(path)
+    return {
+        (store_id, industry): (radius, radius_unit, updated)
+        for store_id, industry, radius, radius_unit, updated in zip(
+            *(radii[column].tolist() for column in STORE_RADIUS_COLUMNS)
+        )
+    }
+
+
+def get_store_radius(store_id, industry, path=STORE_RADIUS_CSV, max_age_days=STORE_RADIUS_MAX_AGE_DAYS):
+    """
+    The precomputed (radius, radius_unit) for a store and industry, or None if the table
+    doesn't have a recent enough row for it. Reloaded only when the file changes.
+    """
+    if not os.path.exists(path):
+        return None
+
+    entry = _load_store_radii(path, os.path.getmtime(path)).get((store_id, industry))
+    if entry is None:
+        return None
+
+    radius, radius_unit, updated = entry
+    if time.time() - updated > max_age_days * 24 * 60 * 60:
+        return None
+
+    return radius, radius_unit
+
+
+@functools.lru_cache(maxsize=1)
+def _build_walmart_id_index(path, mtime):
+    """Map each store_id to its row position in the store table."""
+    stores = _load_walmart_stores(path, mtime)
+    return dict(zip(stores["store_id"].tolist(), range(len(stores))))
+
+
+def get_walmart_store(store_id, path=WALMART_CSV):
+    """Return the store row for `store_id`, or None if there's no such store."""
+    mtime = os.path.getmtime(path)
+    row = _build_walmart_id_index(path, mtime).get(store_id)
+    if row is None:
+        return None
+
+    return _load_walmart_stores(path, mtime).iloc[row]
+
+
+# Size of the lat/lon grid cells used by the spatial index, in degrees (~28km of latitude)
+SPATIAL_CELL_DEGREES = 0.25
+HALF_EARTH_CIRCUMFERENCE_METERS = 20037508
+
+
+@functools.lru_cache(maxsize=1)
+def _build_walmart_spatial_index(path, mtime):
+    """Bucket store row positions into a lat/lon grid so radius queries only scan nearby cells."""
+    stores = _load_walmart_stores(path, mtime)
+    lats = stores["latitude"].to_numpy(dtype="float64")
+    lons = stores["longitude"].to_numpy(dtype="float64")
+    cells = pd.DataFrame({
+        "lat_cell": np.floor(lats / SPATIAL_CELL_DEGREES).astype("int32"),
+        "lon_cell": np.floor(lons / SPATIAL_CELL_DEGREES).astype("int32"),
+    })
+
+    return {
+        "lats": lats,
+        "lons": lons,
+        "cells": {cell: np.asarray(rows) for cell, rows in cells.groupby(["lat_cell", "lon_cell"]).indices.items()},
+    }
+
+
+def _stores_within(index, lat, lon, radius_meters):
+    """Return (rows, distances) of stores within `radius_meters` of (lat, lon), unsorted."""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_meters)
+    lat_cells = range(int(np.floor(min_lat / SPATIAL_CELL_DEGREES)), int(np.floor(max_lat / SPATIAL_CELL_DEGREES)) + 1)
+    lon_cells = range(int(np.floor(min_lon / SPATIAL_CELL_DEGREES)), int(np.floor(max_lon / SPATIAL_CELL_DEGREES)) + 1)
+
+    cells = index["cells"]
+    if len(lat_cells) * len(lon_cells) > len(cells):
+        # The query covers more cells than are populated; just check the populated ones
+        candidates = [
+            rows
+            for (lat_cell, lon_cell), rows in cells.items()
+            if lat_cell in lat_cells and lon_cell in lon_cells
+        ]
+    else:
+        candidates = [cells[cell] for cell in ((i, j) for i in lat_cells for j in lon_cells) if cell in cells]
+    if not candidates:
+        return np.empty(0, dtype="int64"), np.empty(0)
+
+    rows = np.concatenate(candidates)
+    distances = haversine_meters(lat, lon, index["lats"][rows], index["lons"][rows])
+    within = distances <= radius_meters
+
+    return rows[within], distances[within]
+
+
+def _stores_with_distance(rows, distances, path):
+    stores = get_walmart_stores(path).iloc[rows].assign(distance_meters=distances)
+    return stores.sort_values("distance_meters", kind="stable")
+
+
+def find_walmart_stores_within(lat, lon, radius_meters, path=WALMART_CSV):
+    """Return stores within `radius_meters` of (lat, lon), nearest first, with a `distance_meters` column."""
+    index = _build_walmart_spatial_index(path, os.path.getmtime(path))
+    rows, distances = _stores_within(index, lat, lon, radius_meters)
+
+    return _stores_with_distance(rows, distances, path)
+
+
+def find_nearest_walmart_stores(lat, lon, k=5, path=WALMART_CSV):
+    """Return the `k` stores nearest to (lat, lon), nearest first, with a `distance_meters` column."""
+    index = _build_walmart_spatial_index(path, os.path.getmtime(path))
+
+    # Widen the search until it holds at least k stores; those must include the k nearest
+    radius_meters = SPATIAL_CELL_DEGREES * METERS_PER_DEGREE_LAT
+    while True:
+        rows, distances = _stores_within(index, lat, lon, radius_meters)
+        if len(rows) >= k or radius_meters >= HALF_EARTH_CIRCUMFERENCE_METERS:
+            break
+        radius_meters *= 2
+
+    nearest = np.argsort(distances, kind="stable")[:k]
+    return _stores_with_distance(rows[nearest], distances[nearest], path)
+
+
+def walmart_place_id(store_id):
+    return f"walmart_{store_id}"
+
+
+def format_walmart_address(store):
+    return f"{store['street_address']}, {store['city']}, {store['state']} {store['zip_code']}"
+
+
+# Relative weight of a query token matching each field
+SEARCH_FIELD_WEIGHTS = {"name": 3, "city": 2, "zip_code": 2, "state": 1}
+
+# Words that appear in the query but not in the CSV ("walmart conway ar")
+SEARCH_STOPWORDS = {"walmart"}
+
+
+@functools.lru_cache(maxsize=1)
+def _build_walmart_search_index(path, mtime):
+    """Autocomplete index over store name, city, state and zip code; equal scores sort by name."""
+    stores = _load_walmart_stores(path, mtime)
+    fields = {
+        field: (stores[field].astype(str).tolist(), weight)
+        for field, weight in SEARCH_FIELD_WEIGHTS.items()
+    }
+    index = build_search_index(fields, tiebreak=fields["name"][0])
+
+    index["descriptions"] = (
+        stores["name"] + " - " + stores["street_address"] + ", " + stores["city"].astype("string") + ", "
+        + stores["state"].astype("string") + " " + stores["zip_code"]
+    ).tolist()
+    index["place_ids"] = [walmart_place_id(store_id) for store_id in stores["store_id"].tolist()]
+
+    return index
+
+
+def get_walmart_search_index(path=WALMART_CSV):
+    return _build_walmart_search_index(path, os.path.getmtime(path))
+
+
+def rank_walmart_stores(index, query, limit=10):
+    """Return the row positions of the best `limit` stores matching every token in `query`."""
+    return rank(index, query, limit=limit, stopwords=SEARCH_STOPWORDS)
+
+
+def search_walmart_stores(search_term, limit=10):
+    index = get_walmart_search_index()
+
+    return [
+        {
+            "description": index["descriptions"][row],
+            "place_id": index["place_ids"][row],
+        }
+        for row in rank_walmart_stores(index, search_term, limit=limit)
+    ]
 
 def get_walmart_details(place_id):
-    try:
-        # Get the store name from place_id
-        store_name = place_id[8:].replace('_', ' ')
-        
-        # Load Walmart data
-        walmart_data = pd.read_csv("walmart_2018_11_06.csv")
-        
-        # Find the matching store
-        store = walmart_data[walmart_data['name'] == store_name].iloc[0]
-        
-        # Return in similar format to Google Places
-        return {
-            "result": {
-                "geometry": {
-                    "location": {
-                        "lat": store['latitude'],
-                        "lng": store['longitude']
-                    }
-                },
-                "name": store['name'],
-                # *** THE FIX IS HERE: Changed row['zip_code'] to store['zip_code'] ***
-                "formatted_address": f"{store['street_address']}, {store['city']}, {store['state']} {store['zip_code']}",
-                "walmart_data": store.to_dict()
-            }
+    """Details for a `walmart_<store_id>` place_id, or None if there's no such store."""
+    store = get_walmart_store(place_id.removeprefix("walmart_"))
+    if store is None:
+        return None
+
+    # Return in similar format to Google Places
+    return {
+        "result": {
+            "geometry": {
+                "location": {
+                    "lat": float(store['latitude']),
+                    "lng": float(store['longitude'])
+                }
+            },
+            "name": store['name'],
+            "formatted_address": format_walmart_address(store),
+            "walmart_data": store.to_dict()
         }
-    except Exception as e:
-        st.error(f"Error getting Walmart store details: {e}")
-        return None
\ No newline at end of file
+    }